@@ -0,0 +1,134 @@
+# Adaptive concurrency limit shared by the threaded and async DNS paths
+# Grows while latency and error rates stay healthy and backs off when timeouts or SERVFAILs spike (AIMD),
+# so a run slows down for a struggling resolver instead of piling more queries onto it
+
+import threading
+
+
+class AdaptiveLimit:
+    def __init__(self, initial, maximum=None, minimum=1, adaptive=True, errorRate=0.05, latencyFactor=3.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.adaptive = adaptive
+        self.errorRate = errorRate
+        self.latencyFactor = latencyFactor
+        self.condition = threading.Condition()
+        self.inFlight = 0
+        self.peakInFlight = 0
+        self.baselineLatency = None
+        self.resetWindow()
+
+    def resetWindow(self):
+        self.windowCount = 0
+        self.windowFailures = 0
+        self.windowLatency = 0.0
+        self.windowLatencyCount = 0
+        self.peakInFlight = self.inFlight
+
+    def current(self):
+        return int(self.limit)
+
+    # Called once per query attempt; timeouts, SERVFAILs and errors count as failures.
+    # latency is None when there is no reply time to go by, like a timeout or a query that never went out
+    def record(self, failed, latency=None):
+        if not self.adaptive:
+            return
+        with self.condition:
+            self.windowCount += 1
+            if failed:
+                self.windowFailures += 1
+            if latency is not None:
+                self.windowLatency += latency
+                self.windowLatencyCount += 1
+            # Judge roughly one round of queries at a time
+            if self.windowCount >= max(20, self.current()):
+                self.adjust()
+
+    def adjust(self):
+        averageLatency = self.windowLatency / self.windowLatencyCount if self.windowLatencyCount else None
+        failing = self.windowFailures / self.windowCount > self.errorRate
+        slow = (averageLatency is not None and self.baselineLatency is not None
+                and averageLatency > self.baselineLatency * self.latencyFactor)
+        # The baseline drops straight to a faster window and drifts toward a slower one, as long as nothing failed.
+        # Slow windows count too, so a resolver that gets slower for good, like one that stops answering from its cache
+        # and has to recurse, stops looking slow after a few windows instead of holding the limit down forever
+        if averageLatency is not None and not failing:
+            if self.baselineLatency is None or averageLatency < self.baselineLatency:
+                self.baselineLatency = averageLatency
+            else:
+                self.baselineLatency += (averageLatency - self.baselineLatency) * 0.2
+        if failing or slow:
+            self.limit = max(self.minimum, self.limit * 0.7)
+        else:
+            # Only grow if the current limit was actually being used
+            if self.peakInFlight >= self.current():
+                self.limit = min(self.maximum, self.limit + max(1.0, self.limit * 0.1))
+        self.resetWindow()
+        self.condition.notify_all()
+
+    # Thread side: block until there is room under the current limit
+    def acquire(self):
+        with self.condition:
+            while self.inFlight >= self.current():
+                self.condition.wait()
+            self.inFlight += 1
+            self.peakInFlight = max(self.peakInFlight, self.inFlight)
+
+    def release(self):
+        with self.condition:
+            self.inFlight -= 1
+            self.condition.notify()
+
+    # Async side: the event loop keeps its own outstanding count and only reports it here
+    def setInFlight(self, count):
+        self.inFlight = count
+        self.peakInFlight = max(self.peakInFlight, count)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# Splits one limit between jobs running at the same time on one event loop, e.g. in the daemon.
+# Every job may have its equal part in flight, or more while the other jobs leave the budget unused
+class FairShare:
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.shares = set()
+
+    def join(self):
+        share = JobShare(self)
+        self.shares.add(share)
+        return share
+
+    def leave(self, share):
+        self.shares.discard(share)
+        self.limiter.setInFlight(self.inFlight())
+
+    def inFlight(self):
+        return sum(share.inFlight for share in self.shares)
+
+
+class JobShare:
+    def __init__(self, fairShare):
+        self.fairShare = fairShare
+        self.inFlight = 0
+
+    def current(self):
+        limit = self.fairShare.limiter.current()
+        others = self.fairShare.inFlight() - self.inFlight
+        return max(1, limit // len(self.fairShare.shares), limit - others)
+
+    def setInFlight(self, count):
+        self.inFlight = count
+        self.fairShare.limiter.setInFlight(self.fairShare.inFlight())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fairShare.leave(self)
@@ -0,0 +1,142 @@
+# Non-blocking DNS resolution shared by enumerateAzureSubDomains.py and enumerateAzureBlobs.py
+# Keeps thousands of queries in flight on one event loop, bounded by a concurrency limit
+
+import asyncio
+import time
+
+import scanStats
+from resolverPool import ResolverPool
+
+try:
+    import resource
+except ModuleNotFoundError:
+    resource = None # Windows has no open file limit to read
+
+
+# Shared by every async engine: subclasses provide resolve(name) and set self.concurrency,
+# or an adaptiveLimit.AdaptiveLimit as self.limiter to let the number of queries in flight adjust itself.
+# resolve returns the IP if the name exists, '' if it doesn't, and None if no definitive answer came back
+class DnsEngine:
+    concurrency = 1000
+    cache = None # optional dnsCache.DnsCache consulted before any query is sent
+    stats = None # optional scanStats.ScanStats told about every query and finished name
+    limiter = None
+
+    def recordQuery(self, outcome, started):
+        # A timeout has no reply time, and an error is too quick to say anything about the resolver
+        latency = time.perf_counter() - started if outcome not in (scanStats.TIMEOUT, scanStats.ERROR) else None
+        if self.stats:
+            self.stats.query(outcome, latency)
+        if self.limiter:
+            self.limiter.record(outcome in (scanStats.TIMEOUT, scanStats.SERVFAIL, scanStats.ERROR), latency)
+
+    def currentLimit(self):
+        return self.limiter.current() if self.limiter else self.concurrency
+
+    async def resolveAndCache(self, name):
+        ip = await self.resolve(name)
+        if ip is not None and self.cache:
+            self.cache.put(name, ip)
+        if self.stats:
+            self.stats.done(bool(ip))
+        return ip
+
+    def cached(self, name):
+        if self.cache:
+            cached = self.cache.get(name)
+            if cached is not None:
+                if self.stats:
+                    self.stats.done(bool(cached), cached=True)
+                return cached
+        return None
+
+    async def lookup(self, name):
+        cached = self.cached(name)
+        if cached is not None:
+            return cached
+        return await self.resolveAndCache(name)
+
+    # Resolves an iterable of names, yielding (name, ip) pairs as they complete.
+    # Names are pulled lazily so at most `concurrency` (or the limiter's current limit) queries are ever outstanding.
+    # share, an adaptiveLimit.JobShare, narrows that to this call's part of a limit other calls are using at the same time
+    async def resolveMany(self, names, share=None):
+        results = asyncio.Queue()
+        tasks = set()
+        outstanding = 0
+
+        async def resolveInto(name):
+            await results.put((name, await self.resolveAndCache(name)))
+
+        try:
+            for name in names:
+                cached = self.cached(name)
+                if cached is not None:
+                    yield name, cached
+                    continue
+                # A loop rather than an if, since the limit may have just been lowered
+                while outstanding >= (min(share.current(), self.currentLimit()) if share else self.currentLimit()):
+                    outstanding -= 1
+                    yield await results.get()
+                task = asyncio.ensure_future(resolveInto(name))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                outstanding += 1
+                if share:
+                    share.setInFlight(outstanding)
+                elif self.limiter:
+                    self.limiter.setInFlight(outstanding)
+            while outstanding:
+                outstanding -= 1
+                yield await results.get()
+                # Out of names, so what this call no longer needs goes back to the others
+                if share:
+                    share.setInFlight(outstanding)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if share:
+                share.setInFlight(0)
+
+    async def close(self):
+        pass
+
+
+# Most queries that can each hold their own UDP socket at once: three quarters of the open file limit,
+# leaving the rest for the cache, output files and HTTP connections. None when there is no limit to go by
+def socketLimit():
+    if resource is None:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return max(1, soft * 3 // 4)
+
+
+# Every query opens a socket of its own, so the number in flight is kept under socketLimit() however high -c or the limiter goes
+class AsyncDnsEngine(DnsEngine):
+    def __init__(self, concurrency=1000, timeout=2.0, retries=2, nameservers=None, cache=None, stats=None, limiter=None, pool=None):
+        self.socketLimit = socketLimit()
+        self.concurrency = max(1, min(concurrency, self.socketLimit or concurrency))
+        self.cache = cache
+        self.stats = stats
+        self.limiter = limiter
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        # Every attempt goes to an upstream picked by the pool, so retries are ours and land on a different resolver
+        self.pool = pool or ResolverPool(nameservers)
+
+    def currentLimit(self):
+        return min(super().currentLimit(), self.socketLimit or self.concurrency)
+
+    async def resolve(self, name):
+        tried = set()
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            ip, outcome, upstream = await self.pool.queryAsync(name, self.timeout, exclude=tried)
+            self.recordQuery(outcome, started)
+            # Timeouts, SERVFAILs and errors like running out of sockets are worth another try
+            if outcome in (scanStats.TIMEOUT, scanStats.SERVFAIL, scanStats.ERROR):
+                tried.add(upstream)
+                continue
+            return ip
+        return None
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+# Fake Bing Web Search endpoint for trying enumerateAzureBlobs.py -bk offline, with --bing-endpoint
+# Answers /v7.0/search with pages of blob URLs under the base named in the query, in the same JSON shape
+# as Bing. Result n of a query is always the same, so runs are repeatable
+
+import argparse
+import asyncio
+import zlib
+
+from aiohttp import web
+
+
+class FakeBing:
+    def __init__(self, results, accounts, latency):
+        self.results = results
+        self.accounts = accounts
+        self.latency = latency
+        self.requests = 0
+
+    # Result n: one of a few accounts named after the base, a container and a file in it
+    def resultUrl(self, base, index):
+        account = f'{base}{zlib.crc32(f"account:{index}".encode()) % self.accounts}'
+        container = f'container{zlib.crc32(f"container:{index}".encode()) % 20}'
+        return f'https://{account}.blob.core.windows.net/{container}/file{index}.txt'
+
+    async def search(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not request.headers.get('Ocp-Apim-Subscription-Key'):
+            return web.json_response({'error': {'code': 'PermissionDenied'}}, status=401)
+        terms = request.query.get('q', '').split()
+        base = terms[-1].lower() if terms else 'contoso'
+        count = min(50, int(request.query.get('count') or 10))
+        offset = int(request.query.get('offset') or 0)
+        value = [{'name': f'Result {index}', 'url': self.resultUrl(base, index)}
+                 for index in range(offset, min(self.results, offset + count))]
+        return web.json_response({'_type': 'SearchResponse',
+                                  'webPages': {'totalEstimatedMatches': self.results, 'value': value}})
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Fake Bing Web Search endpoint for offline runs of enumerateAzureBlobs.py -bk.')
+    parser.add_argument('--host', help='Address to listen on. Default is 127.0.0.1.', default='127.0.0.1')
+    parser.add_argument('--port', help='HTTP port to listen on. Default is 8080.', type=int, default=8080)
+    parser.add_argument('--results', help='Results every query has. Default is 230.', type=int, default=230)
+    parser.add_argument('--accounts', help='Distinct storage accounts the results are spread over. Default is 8.', type=int, default=8)
+    parser.add_argument('--latency', help='Seconds before each response. Default is 0.3.', type=float, default=0.3)
+    args = parser.parse_args()
+
+    fakeBing = FakeBing(args.results, args.accounts, args.latency)
+    app = web.Application()
+    app.router.add_get('/v7.0/search', fakeBing.search)
+    print(f'Fake Bing endpoint listening on http://{args.host}:{args.port}/v7.0/search', flush=True)
+    web.run_app(app, host=args.host, port=args.port, print=None)
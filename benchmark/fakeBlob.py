@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+# Fake Azure Blob service for benchmarking enumerateAzureBlobs.py offline
+# Serves path-style List Blobs requests (/account/container?restype=container&comp=list), as sent with --blob-endpoint.
+# Which containers are public, how many blobs they hold and which accounts refuse anonymous access
+# all come from stable hashes, so every run sees the same storage.
+# --epoch and --change-rate stand in for time passing between scans: in each epoch some containers lose their
+# oldest blob and gain a new one. Like Azure, listings carry no ETag unless --conditional is given, which makes
+# them carry one and answer If-None-Match with 304, as an endpoint that honors conditional requests would.
+# --busy-rate answers a random share of requests, first pages and later ones alike, with 503 ServerBusy
+
+import argparse
+import asyncio
+import email.utils
+import random
+import zlib
+
+from aiohttp import web
+
+
+# Each decision hashes its own prefix, so it is independent of the others and of which names fakeDns.py resolves
+def hashedFraction(decision, key):
+    return zlib.crc32(f'{decision}:{key}'.encode()) % 10000 / 10000
+
+
+class FakeBlob:
+    def __init__(self, publicRate, denyRate, maxBlobs, pageSize, latency, epoch=0, changeRate=0, conditional=False, busyRate=0):
+        self.publicRate = publicRate
+        self.denyRate = denyRate
+        self.maxBlobs = maxBlobs
+        self.pageSize = pageSize
+        self.latency = latency
+        self.epoch = epoch
+        self.changeRate = changeRate
+        self.conditional = conditional
+        self.busyRate = busyRate
+        self.requests = 0
+
+    # How many times a container has changed by this epoch, which is also how far its blobs have shifted
+    def changes(self, key):
+        return sum(1 for epoch in range(1, self.epoch + 1) if hashedFraction(f'change:{epoch}', key) < self.changeRate)
+
+    def error(self, status, errorCode):
+        return web.Response(status=status, headers={'x-ms-error-code': errorCode})
+
+    async def listBlobs(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.busyRate:
+            return self.error(503, 'ServerBusy')
+        account = request.match_info['account']
+        container = request.match_info['container']
+        if request.query.get('restype') != 'container':
+            return self.error(400, 'InvalidQueryParameterValue')
+        if hashedFraction('deny', account) < self.denyRate:
+            return self.error(409, 'PublicAccessNotPermitted')
+        if hashedFraction('public', f'{account}/{container}') >= self.publicRate:
+            return self.error(404, 'ResourceNotFound')
+        if request.query.get('comp') != 'list':
+            return web.Response(status=200) # Get Container Properties
+        blobCount = int(hashedFraction('blobs', f'{account}/{container}') * (self.maxBlobs + 1))
+        shift = self.changes(f'{account}/{container}')
+        headers = {}
+        if self.conditional:
+            headers['ETag'] = f'"0x{zlib.crc32(f"{account}/{container}:{shift}".encode()):08X}"'
+            headers['Last-Modified'] = email.utils.formatdate(1600000000 + shift * 86400, usegmt=True)
+            if request.headers.get('If-None-Match') == headers['ETag']:
+                return web.Response(status=304, headers=headers)
+        start = int(request.query.get('marker') or shift)
+        pageSize = min(self.pageSize, int(request.query.get('maxresults') or self.pageSize))
+        end = min(blobCount + shift, start + pageSize)
+        nextMarker = str(end) if end < blobCount + shift else ''
+        blobs = ''.join(f'<Blob><Name>blob{index:07d}.dat</Name><Properties><Content-Length>{index}</Content-Length>'
+                        f'<Content-Type>application/octet-stream</Content-Type></Properties></Blob>'
+                        for index in range(start, end))
+        body = (f'<?xml version="1.0" encoding="utf-8"?><EnumerationResults ContainerName="{container}">'
+                f'<MaxResults>{pageSize}</MaxResults><Blobs>{blobs}</Blobs><NextMarker>{nextMarker}</NextMarker></EnumerationResults>')
+        return web.Response(text=body, content_type='application/xml', headers=headers)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Fake Azure Blob service for offline benchmarks of enumerateAzureBlobs.py.')
+    parser.add_argument('--host', help='Address to listen on. Default is 127.0.0.1.', default='127.0.0.1')
+    parser.add_argument('--port', help='HTTP port to listen on. Default is 10000.', type=int, default=10000)
+    parser.add_argument('--public-rate', help='Fraction of account/container guesses that are public containers. Default is 0.05.', type=float, default=0.05)
+    parser.add_argument('--deny-rate', help='Fraction of accounts that refuse anonymous access outright. Default is 0.5.', type=float, default=0.5)
+    parser.add_argument('--max-blobs', help='Most blobs any public container holds. Default is 20000.', type=int, default=20000)
+    parser.add_argument('--page-size', help='Blobs per List Blobs page. Default is 5000, the same as Azure.', type=int, default=5000)
+    parser.add_argument('--latency', help='Seconds before each response. Default is 0.', type=float, default=0)
+    parser.add_argument('--epoch', help='How many rounds of changes have happened to the storage. Default is 0.', type=int, default=0)
+    parser.add_argument('--change-rate', help='Fraction of public containers that change in each epoch. Default is 0.05.', type=float, default=0.05)
+    parser.add_argument('--conditional', help='Send an ETag and Last-Modified with each listing and answer a matching If-None-Match with 304.', action='store_true')
+    parser.add_argument('--busy-rate', help='Fraction of requests answered with 503 ServerBusy, at random. Default is 0.', type=float, default=0)
+    args = parser.parse_args()
+
+    fakeBlob = FakeBlob(args.public_rate, args.deny_rate, args.max_blobs, args.page_size, args.latency,
+                        epoch=args.epoch, changeRate=args.change_rate, conditional=args.conditional,
+                        busyRate=args.busy_rate)
+    app = web.Application()
+    app.router.add_get('/{account}/{container}', fakeBlob.listBlobs)
+    print(f'Fake Blob service listening on http://{args.host}:{args.port}', flush=True)
+    web.run_app(app, host=args.host, port=args.port, print=None)
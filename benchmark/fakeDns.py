@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+# Fake authoritative DNS server for benchmarking the enumeration scripts offline
+# Answers A queries for a configurable set of Azure names, NXDOMAIN for everything else,
+# with tunable latency, jitter, packet loss and SERVFAIL rate
+
+import argparse
+import asyncio
+import random
+import zlib
+
+# Suffixes whose names can be hits when --hit-rate is used
+AZURE_SUFFIXES = ('core.windows.net', 'azurewebsites.net', 'onmicrosoft.com', 'cloudapp.net', 'outlook.com',
+                  'sharepoint.com', 'azure.com', 'azure.net', 'azureedge.net', 'azure-api.net')
+
+
+# Every name for which crc32 falls under the rate is a hit, so runs are repeatable without a names file
+def hashedHit(name, rate):
+    return name.endswith(AZURE_SUFFIXES) and zlib.crc32(name.encode()) % 10000 < rate * 10000
+
+def encodeAnswer(query, rcode, address=None):
+    # The question ends at the root label, followed by QTYPE and QCLASS
+    end = 12
+    while query[end]:
+        end += query[end] + 1
+    question = query[12:end + 5]
+    flags = bytes([0x85, 0x80 | rcode]) # QR, AA, RD, RA
+    if address is None:
+        return query[:2] + flags + b'\x00\x01\x00\x00\x00\x00\x00\x00' + question
+    record = b'\xc0\x0c\x00\x01\x00\x01\x00\x00\x01\x2c\x00\x04' + address # pointer to the question name, A, IN, TTL 300
+    return query[:2] + flags + b'\x00\x01\x00\x01\x00\x00\x00\x00' + question + record
+
+def decodeName(query):
+    labels = []
+    offset = 12
+    while query[offset]:
+        length = query[offset]
+        labels.append(query[offset + 1:offset + 1 + length])
+        offset += length + 1
+    return b'.'.join(labels).decode('ascii', 'replace').lower()
+
+
+class FakeDns(asyncio.DatagramProtocol):
+    def __init__(self, names, hitRate, blobHitRate, latency, jitter, loss, servfail):
+        self.names = names
+        self.hitRate = hitRate
+        self.blobHitRate = blobHitRate
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.servfail = servfail
+        self.transport = None
+        self.loop = asyncio.get_running_loop()
+        self.queries = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def answer(self, query):
+        name = decodeName(query)
+        if self.servfail and random.random() < self.servfail:
+            return encodeAnswer(query, 2)
+        hitRate = self.blobHitRate if name.endswith('.blob.core.windows.net') else self.hitRate
+        if name in self.names or (hitRate and hashedHit(name, hitRate)):
+            address = bytes([10]) + zlib.crc32(name.encode()).to_bytes(4, 'big')[1:]
+            return encodeAnswer(query, 0, address)
+        return encodeAnswer(query, 3)
+
+    def datagram_received(self, data, addr):
+        self.queries += 1
+        if len(data) < 17 or (self.loss and random.random() < self.loss):
+            return
+        try:
+            response = self.answer(data)
+        except IndexError:
+            return # malformed question
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(-self.jitter, self.jitter) * self.latency
+        if delay > 0:
+            self.loop.call_later(delay, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+
+async def serve(args, names):
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(
+        lambda: FakeDns(names, args.hit_rate, args.hit_rate if args.blob_hit_rate is None else args.blob_hit_rate, args.latency, args.jitter, args.loss, args.servfail),
+        local_addr=(args.host, args.port))
+    print(f'Fake DNS listening on {args.host}:{args.port}', flush=True)
+    await asyncio.Event().wait()
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Fake authoritative DNS server for offline benchmarks of the enumeration scripts.')
+    parser.add_argument('--host', help='Address to listen on. Default is 127.0.0.1.', default='127.0.0.1')
+    parser.add_argument('--port', help='UDP port to listen on. Default is 5300.', type=int, default=5300)
+    parser.add_argument('--names', help='File with one name per line that should resolve.')
+    parser.add_argument('--hit-rate', help='Fraction of all Azure names that resolve, picked by a stable hash. Default is 0.', type=float, default=0)
+    parser.add_argument('--blob-hit-rate', help='Fraction of storage account names that resolve, if different from --hit-rate.', type=float)
+    parser.add_argument('--latency', help='Seconds before each reply is sent. Default is 0.', type=float, default=0)
+    parser.add_argument('--jitter', help='Random spread of the latency, as a fraction of it. Default is 0.', type=float, default=0)
+    parser.add_argument('--loss', help='Fraction of queries dropped without a reply. Default is 0.', type=float, default=0)
+    parser.add_argument('--servfail', help='Fraction of queries answered with SERVFAIL. Default is 0.', type=float, default=0)
+    args = parser.parse_args()
+
+    names = set()
+    if args.names:
+        with open(args.names) as namesFile:
+            names = {line.strip().lower() for line in namesFile if line.strip()}
+
+    try:
+        asyncio.run(serve(args, names))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+
+# Offline benchmark for enumerateAzureSubDomains.py and enumerateAzureBlobs.py
+# Starts the fake DNS and Blob servers from this directory, runs each script once per library against them
+# and writes wall time, throughput, latency percentiles and peak memory of every run to a JSON report.
+# Peak memory comes from wait4, so this runs on Linux and macOS but not Windows
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from tabulate import tabulate # for printing a pretty table
+except ModuleNotFoundError:
+    print('Use `pip install -r requirements.txt` to install the required modules to use this script')
+    exit()
+
+benchmarkDirectory = os.path.dirname(os.path.realpath(__file__))
+repoDirectory = os.path.dirname(benchmarkDirectory)
+
+
+def startServer(command):
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    server.stdout.readline() # the listening line, so the port is open before any script starts
+    return server
+
+# Runs one script to completion, returning (wall seconds, peak memory in MB, exit code, output)
+def runScript(command, timeout):
+    with tempfile.TemporaryFile('w+') as outputFile:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdout=outputFile, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, cwd=workDirectory)
+        killer = threading.Timer(timeout, process.kill)
+        killer.start()
+        # wait4 rather than wait, for the peak memory of the run; it covers the script's worker processes too
+        _, status, usage = os.wait4(process.pid, 0)
+        wallTime = time.perf_counter() - started
+        killer.cancel()
+        process.returncode = os.waitstatus_to_exitcode(status)
+        outputFile.seek(0)
+        output = outputFile.read()
+    peakMemory = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return wallTime, round(peakMemory, 1), process.returncode, output
+
+def readStats(statsPath):
+    try:
+        with open(statsPath) as statsFile:
+            return json.load(statsFile)['summary']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def libraryArguments(library):
+    command = ['-l', library, '-c', str(args.concurrency), '-t', str(args.threads)]
+    if library == 'processes':
+        command += ['--processes', str(args.processes)]
+    return command
+
+# Without the hit history, so every library generates the same names in the same order and no run learns from the last
+def benchmarkSubdomains(library):
+    statsPath = os.path.join(workDirectory, f'subdomains-{library}.json')
+    command = [sys.executable, os.path.join(repoDirectory, 'enumerateAzureSubDomains.py'), '-bf', basesPath,
+               '-p', permutationsPath, '--resolvers', f'127.0.0.1:{args.dns_port}', '--no-cache', '--no-history',
+               '--stats-json', statsPath] + libraryArguments(library)
+    wallTime, peakMemory, exitCode, output = runScript(command, args.run_timeout)
+    return report('subdomains', library, wallTime, peakMemory, exitCode, readStats(statsPath))
+
+def benchmarkBlobs(library):
+    statsPath = os.path.join(workDirectory, f'blobs-{library}.json')
+    outputPath = os.path.join(workDirectory, f'blobs-{library}.txt')
+    command = [sys.executable, os.path.join(repoDirectory, 'enumerateAzureBlobs.py'), '-b', bases[0],
+               '-p', permutationsPath, '-f', foldersPath, '-o', outputPath,
+               '--resolvers', f'127.0.0.1:{args.dns_port}', '--no-cache', '--stats-json', statsPath,
+               '--blob-endpoint', f'http://127.0.0.1:{args.blob_port}'] + libraryArguments(library)
+    wallTime, peakMemory, exitCode, output = runScript(command, args.run_timeout)
+    result = report('blobs', library, wallTime, peakMemory, exitCode, readStats(statsPath))
+    requests = re.search(r'(\d+) container requests', output)
+    result['containerRequests'] = int(requests.group(1)) if requests else None
+    result['results'] = 0
+    if os.path.isfile(outputPath):
+        with open(outputPath) as outputFile:
+            result['results'] = sum(1 for _ in outputFile)
+    return result
+
+def report(script, library, wallTime, peakMemory, exitCode, stats):
+    result = {
+        'script': script,
+        'library': library,
+        'exitCode': exitCode,
+        'wallSeconds': round(wallTime, 3),
+        'peakMemoryMB': peakMemory
+    }
+    if stats:
+        result.update({
+            'names': stats['done'],
+            'namesPerSecond': round(stats['done'] / wallTime, 1),
+            'queries': stats['queries'],
+            'hits': stats['hits'],
+            'timeouts': stats['outcomes']['timeout'],
+            'servfail': stats['outcomes']['servfail'],
+            'latencyP50': stats['latencyP50'],
+            'latencyP90': stats['latencyP90'],
+            'latencyP99': stats['latencyP99']
+        })
+    return result
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks every library of both enumeration scripts against local fake DNS and Blob servers.')
+    parser.add_argument('-o', '--output', help='File to write the JSON report to. Default is benchmarkReport.json.', default='benchmarkReport.json')
+    parser.add_argument('-b', '--bases', help='Comma separated base names. Default is contoso,fabrikam,northwind,tailspin.', default='contoso,fabrikam,northwind,tailspin')
+    parser.add_argument('-p', '--permutations', help='Permutations file. Default is permutations.txt in the repo.', default=os.path.join(repoDirectory, 'permutations.txt'))
+    parser.add_argument('-f', '--folders', help='Folders file for the blob script. Default is the permutations file.')
+    parser.add_argument('--scripts', help='Comma separated scripts to benchmark: subdomains, blobs. Default is both.', default='subdomains,blobs')
+    parser.add_argument('--libraries', help='Comma separated libraries to run. Default is every library each script supports.')
+    parser.add_argument('-t', '--threads', help='Threads for the threaded libraries. Default is 10.', type=int, default=10)
+    parser.add_argument('-c', '--concurrency', help='Queries in flight for the async libraries. Default is 1000.', type=int, default=1000)
+    parser.add_argument('--processes', help='Worker processes for the processes library. Default is the number of CPUs.', type=int, default=os.cpu_count())
+    parser.add_argument('--hit-rate', help='Fraction of Azure names the fake DNS resolves. Default is 0.01.', type=float, default=0.01)
+    parser.add_argument('--blob-hit-rate', help='Fraction of storage account names the fake DNS resolves. Default is 0.1.', type=float, default=0.1)
+    parser.add_argument('--latency', help='Fake DNS reply latency in seconds. Default is 0.002.', type=float, default=0.002)
+    parser.add_argument('--jitter', help='Fake DNS latency spread, as a fraction of the latency. Default is 0.5.', type=float, default=0.5)
+    parser.add_argument('--loss', help='Fraction of DNS queries the fake server drops. Default is 0.', type=float, default=0)
+    parser.add_argument('--servfail', help='Fraction of DNS queries the fake server answers with SERVFAIL. Default is 0.', type=float, default=0)
+    parser.add_argument('--http-latency', help='Fake Blob service response latency in seconds. Default is 0.01.', type=float, default=0.01)
+    parser.add_argument('--public-rate', help='Fraction of container guesses the fake Blob service lists. Default is 0.05.', type=float, default=0.05)
+    parser.add_argument('--deny-rate', help='Fraction of accounts the fake Blob service refuses outright. Default is 0.5.', type=float, default=0.5)
+    parser.add_argument('--max-blobs', help='Most blobs in any fake public container. Default is 2000.', type=int, default=2000)
+    parser.add_argument('--dns-port', help='Port for the fake DNS server. Default is 5300.', type=int, default=5300)
+    parser.add_argument('--blob-port', help='Port for the fake Blob service. Default is 10000.', type=int, default=10000)
+    parser.add_argument('--run-timeout', help='Seconds before a single run is killed. Default is 600.', type=float, default=600)
+    args = parser.parse_args()
+
+    scripts = args.scripts.split(',')
+    bases = [base.strip() for base in args.bases.split(',') if base.strip()]
+    permutationsPath = os.path.realpath(args.permutations)
+    foldersPath = os.path.realpath(args.folders or args.permutations)
+    libraries = {
+        'subdomains': ['none','threading','futures','asyncio','udp','processes'],
+        'blobs': ['threading','asyncio','udp','processes']
+    }
+
+    # Scratch space for the bases file and each run's stats, removed once the runs are done
+    with tempfile.TemporaryDirectory(prefix='microburstBenchmark') as workDirectory:
+        basesPath = os.path.join(workDirectory, 'bases.txt')
+        with open(basesPath, 'w') as basesFile:
+            basesFile.write('\n'.join(bases) + '\n')
+
+        servers = [startServer([sys.executable, os.path.join(benchmarkDirectory, 'fakeDns.py'), '--port', str(args.dns_port),
+                                '--hit-rate', str(args.hit_rate), '--blob-hit-rate', str(args.blob_hit_rate), '--latency', str(args.latency), '--jitter', str(args.jitter),
+                                '--loss', str(args.loss), '--servfail', str(args.servfail)])]
+        if 'blobs' in scripts:
+            servers.append(startServer([sys.executable, os.path.join(benchmarkDirectory, 'fakeBlob.py'), '--port', str(args.blob_port),
+                                        '--public-rate', str(args.public_rate), '--deny-rate', str(args.deny_rate),
+                                        '--max-blobs', str(args.max_blobs), '--latency', str(args.http_latency)]))
+
+        results = []
+        try:
+            for script in scripts:
+                for library in libraries[script]:
+                    if args.libraries and library not in args.libraries.split(','):
+                        continue
+                    print(f'Running {script} with {library}...', flush=True)
+                    if script == 'subdomains':
+                        results.append(benchmarkSubdomains(library))
+                    else:
+                        results.append(benchmarkBlobs(library))
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+    with open(args.output, 'w') as reportFile:
+        json.dump({
+            'started': time.time(),
+            'python': sys.version.split()[0],
+            'cpus': os.cpu_count(),
+            'settings': vars(args),
+            'results': results
+        }, reportFile, indent=1)
+
+    columns = ['script', 'library', 'exitCode', 'wallSeconds', 'namesPerSecond', 'hits', 'timeouts', 'latencyP50', 'latencyP99', 'peakMemoryMB', 'results']
+    print(tabulate([[result.get(column) for column in columns] for result in results], headers=columns))
+    print(f'Report written to {args.output}')
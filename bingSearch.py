@@ -0,0 +1,123 @@
+# Bing Web Search discovery for enumerateAzureBlobs.py
+# The first result page tells how many results there are, then the rest of the pages up to the chosen depth
+# are fetched at once over aiohttp. Pages are kept in SQLite keyed by request URL, so re-running a scan
+# against the same base doesn't spend API calls again until they're older than maxAge
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import aiohttp
+
+BING_ENDPOINT = 'https://api.bing.microsoft.com/v7.0/search'
+PAGE_SIZE = 50 # the most results Bing returns per request
+
+
+class SearchCache:
+    def __init__(self, path, maxAge=7*24*60*60):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS pages (
+                                    url TEXT PRIMARY KEY,
+                                    body TEXT NOT NULL,
+                                    fetchedAt REAL NOT NULL)''')
+        self.connection.commit()
+
+    # returns the parsed page, or None if it has to be fetched
+    def get(self, url):
+        with self.lock:
+            row = self.connection.execute('SELECT body FROM pages WHERE url = ? AND fetchedAt > ?',
+                                          (url, time.time() - self.maxAge)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, url, page):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)', (url, json.dumps(page), time.time()))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM pages WHERE fetchedAt <= ?', (time.time() - self.maxAge,))
+            self.connection.commit()
+            self.connection.close()
+
+
+# depth is the most result pages fetched per query. cache is an optional SearchCache, owned by the caller.
+# Failed requests are counted in errors and, if warn is given, passed to it as a message
+class BingSearch:
+    def __init__(self, apiKey, endpoint=BING_ENDPOINT, depth=5, timeout=15.0, cache=None, warn=None):
+        self.apiKey = apiKey
+        self.endpoint = endpoint
+        self.depth = max(1, depth)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.cache = cache
+        self.warn = warn
+        self.requests = 0
+        self.cached = 0
+        self.errors = 0
+
+    # One page of results as parsed JSON, or None if the request failed
+    async def fetchPage(self, session, query, offset):
+        url = f'{self.endpoint}?{urllib.parse.urlencode({"q": query, "count": PAGE_SIZE, "offset": offset})}'
+        if self.cache:
+            page = self.cache.get(url)
+            if page is not None:
+                self.cached += 1
+                return page
+        self.requests += 1
+        try:
+            async with session.get(url, headers={'Ocp-Apim-Subscription-Key': self.apiKey}) as response:
+                response.raise_for_status()
+                page = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as error:
+            self.errors += 1
+            if self.warn:
+                self.warn(f'Error getting Bing API response for results {offset}-{offset + PAGE_SIZE}: {error}')
+            return None
+        if self.cache:
+            self.cache.put(url, page)
+        return page
+
+    # Result pages for query as they arrive, the first one first
+    async def pages(self, query):
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
+            first = await self.fetchPage(session, query, 0)
+            if not first:
+                return
+            yield first
+            total = first.get('webPages', {}).get('totalEstimatedMatches', 0)
+            offsets = range(PAGE_SIZE, min(total, self.depth * PAGE_SIZE), PAGE_SIZE)
+            fetches = [asyncio.ensure_future(self.fetchPage(session, query, offset)) for offset in offsets]
+            try:
+                for fetch in asyncio.as_completed(fetches):
+                    page = await fetch
+                    if page:
+                        yield page
+            finally:
+                for fetch in fetches:
+                    fetch.cancel()
+
+    # (storage account host, container) for each distinct blob URL in the results, as pages arrive.
+    # container is '' for a result that links to the account itself
+    async def discover(self, query, domain='.blob.core.windows.net'):
+        seen = set()
+        async for page in self.pages(query):
+            for result in page.get('webPages', {}).get('value', []):
+                urlSplit = urllib.parse.urlsplit(result.get('url', ''))
+                host = urlSplit.netloc.lower()
+                container = urlSplit.path.lstrip('/').split('/')[0].lower()
+                if host.endswith(domain) and (host, container) not in seen:
+                    seen.add((host, container))
+                    yield host, container
+
+    def summary(self):
+        return f'{self.requests} Bing API requests, {self.cached} pages from cache, {self.errors} errors'
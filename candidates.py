@@ -0,0 +1,436 @@
+# Lazy candidate generation for enumerateAzureSubDomains.py and enumerateAzureBlobs.py
+# Names are produced one at a time and handed to workers through bounded queues,
+# so memory stays flat no matter how large the base or word lists are
+
+import asyncio
+import collections
+import re
+import threading
+import time
+import zlib
+
+from hitHistory import BASE_ONLY
+
+# Domain = Service dictionary for easier lookups
+subLookup = {
+    'onmicrosoft.com':'Microsoft Hosted Domain',
+    'scm.azurewebsites.net':'App Services - Management',
+    'azurewebsites.net':'App Services',
+    'p.azurewebsites.net':'App Services',
+    'cloudapp.net':'App Services',
+    'file.core.windows.net':'Storage Accounts - Files',
+    'blob.core.windows.net':'Storage Accounts - Blobs',
+    'queue.core.windows.net':'Storage Accounts - Queues',
+    'table.core.windows.net':'Storage Accounts - Tables',
+    'mail.protection.outlook.com':'Email',
+    'sharepoint.com':'SharePoint',
+    'redis.cache.windows.net':'Databases-Redis',
+    'documents.azure.com':'Databases-Cosmos DB',
+    'database.windows.net':'Databases-MSSQL',
+    'vault.azure.net':'Key Vaults',
+    'azureedge.net':'CDN',
+    'search.windows.net':'Search Appliance',
+    'azure-api.net':'API Services'
+}
+
+# Any single DNS label: 1-63 letters, numbers and hyphens, not starting or ending with a hyphen
+dnsLabel = re.compile(r'[a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?')
+storageAccount = re.compile(r'[a-z0-9]{3,24}')
+
+# Names Azure can actually register under each subLookup suffix, matched against the lowercased label
+namingRules = {
+    'onmicrosoft.com':re.compile(r'[a-z0-9]{1,27}'), # tenant names are letters and numbers only
+    'scm.azurewebsites.net':re.compile(r'[a-z0-9]([a-z0-9-]{0,58}[a-z0-9])?'),
+    'azurewebsites.net':re.compile(r'[a-z0-9]([a-z0-9-]{0,58}[a-z0-9])?'),
+    'p.azurewebsites.net':re.compile(r'[a-z0-9]([a-z0-9-]{0,58}[a-z0-9])?'),
+    'cloudapp.net':dnsLabel,
+    'file.core.windows.net':storageAccount,
+    'blob.core.windows.net':storageAccount,
+    'queue.core.windows.net':storageAccount,
+    'table.core.windows.net':storageAccount,
+    'mail.protection.outlook.com':dnsLabel,
+    'sharepoint.com':dnsLabel, # tenant names plus -my/-admin style hosts
+    'redis.cache.windows.net':re.compile(r'(?!.*--)[a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?'),
+    'documents.azure.com':re.compile(r'[a-z0-9]([a-z0-9-]{1,42}[a-z0-9])'),
+    'database.windows.net':dnsLabel,
+    'vault.azure.net':re.compile(r'(?!.*--)[a-z][a-z0-9-]{1,22}[a-z0-9]'),
+    'azureedge.net':re.compile(r'[a-z0-9]([a-z0-9-]{0,48}[a-z0-9])?'),
+    'search.windows.net':re.compile(r'(?!.*--)[a-z0-9][a-z0-9-]{0,58}[a-z0-9]'),
+    'azure-api.net':re.compile(r'[a-z]([a-z0-9-]{0,48}[a-z0-9])?')
+}
+
+# Suffixes that can only resolve when the same label resolves under a root suffix.
+# e.g. without foo.blob.core.windows.net there is no storage account foo, so no foo.file.core.windows.net either
+suffixDependencies = {
+    'file.core.windows.net':'blob.core.windows.net',
+    'queue.core.windows.net':'blob.core.windows.net',
+    'table.core.windows.net':'blob.core.windows.net',
+    'scm.azurewebsites.net':'azurewebsites.net'
+}
+
+# Blob container names, plus the special containers Azure creates itself
+containerName = re.compile(r'(?!.*--)[a-z0-9][a-z0-9-]{1,61}[a-z0-9]|\$root|\$web|\$logs')
+
+# Tracks how many names generation threw away instead of sending as queries
+class CandidateStats:
+    def __init__(self):
+        self.generated = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.dependable = 0 # names a dependent pass could make from the names generated, see DependentCount
+
+    def saved(self):
+        return self.invalid + self.duplicates
+
+    def report(self):
+        return (f'Skipped {self.saved()} queries: {self.invalid} names Azure would not accept, '
+                f'{self.duplicates} duplicates')
+
+# warn, if given, is called with a message when a base has to be fixed up
+def cleanBase(base, warn=None):
+    base = base.strip()
+    if '.' in base:
+        if warn:
+            warn(f'Invalid base parameter: {base}. Removing periods from base.')
+        base = base.replace('.','')
+    return base
+
+# Streams bases from a file, one per line
+def readBases(path, warn=None):
+    with open(path) as baseFile:
+        for line in baseFile:
+            base = cleanBase(line, warn)
+            if base:
+                yield base
+
+# Bases from a file that can be read more than once, and sent to a worker process as just its path.
+# Bad bases are only warned about on the first read, counted from when a base is first taken rather than from iter()
+class BaseFile:
+    def __init__(self, path, warn=None):
+        self.path = path
+        self.warn = warn
+        self.warned = False
+
+    def __iter__(self):
+        warn = None if self.warned else self.warn
+        self.warned = True
+        yield from readBases(self.path, warn)
+
+# Every distinct label to try for one base, lowercased, in pattern order
+def baseLabels(base, patterns, words):
+    labels = dict.fromkeys([base.lower()])
+    for pattern in patterns:
+        for word in words:
+            labels.setdefault(pattern.format(word=word, base=base).lower())
+    return list(labels)
+
+# Duplicates are dropped within each base and between repeated bases;
+# a cross-base set of every label would grow with the whole candidate space.
+# part (index, count) makes only that share of the names, for one of several worker processes: each base's labels
+# are dealt out in turn, so every suffix of a label goes to the same worker. Counts that belong to no single
+# label, like repeated bases, are left to part 0 so the workers' stats add up to one run's
+def subdomainCandidates(bases, suffixes, patterns, words, stats=None, part=None):
+    partIndex, partCount = part or (0, 1)
+    labelsPerBase = 1 + len(patterns) * len(words)
+    seenBases = set()
+    for base in bases:
+        if base.lower() in seenBases:
+            if stats is not None and partIndex == 0:
+                stats.duplicates += len(suffixes) * labelsPerBase
+            continue
+        baseIndex = len(seenBases)
+        seenBases.add(base.lower())
+        allLabels = baseLabels(base, patterns, words)
+        labels = allLabels[(partIndex - baseIndex) % partCount::partCount]
+        for domain in suffixes:
+            rule = namingRules.get(domain, dnsLabel)
+            if stats is not None and partIndex == 0:
+                stats.duplicates += labelsPerBase - len(allLabels)
+            for label in labels:
+                if rule.fullmatch(label):
+                    if stats is not None:
+                        stats.generated += 1
+                    yield f'{label}.{domain}'
+                elif stats is not None:
+                    stats.invalid += 1
+
+# Names from ranked (pattern, word, suffix) templates, a hitHistory.RankedTemplates walked likeliest first.
+# Templates are the outer loop, so the likeliest ones are tried on every base before any base gets the
+# less likely ones. Only the bases are held in memory, each pattern split around its word so a label is just joined
+# together. The first time a (pattern, word) pair comes up, each of its labels is worked back to the words that would
+# spell it under the other patterns; only the pairs that clash are kept, so a later suffix just asks the ranking
+# which of them comes first.
+# part works as for subdomainCandidates, dealing out (pattern, word, base) labels so each keeps its suffixes together
+def templateCandidates(bases, templates, stats=None, part=None):
+    partIndex, partCount = part or (0, 1)
+    allBases = [base.lower() for base in bases]
+    uniqueBases = list(dict.fromkeys(allBases))
+    if stats is not None and partIndex == 0:
+        stats.duplicates += (len(allBases) - len(uniqueBases)) * len(templates)
+        stats.duplicates += templates.repeats * len(templates.patterns) * len(templates.suffixes) * len(uniqueBases)
+    pieces = {} # pattern -> (text before the word, whether it has one, text after it) for each base
+    for pattern in [BASE_ONLY] + templates.patterns:
+        pieces[pattern] = [pattern.format(word='\0', base=base).lower().partition('\0') for base in uniqueBases]
+    checked = bytearray(templates.pairCount()) # pairs whose clashes have been worked out
+    clashes = {} # pair index -> {base index: the other (pattern, word) pairs that spell the same label}
+    for pattern, word, domain in templates:
+        rule = namingRules.get(domain, dnsLabel)
+        pairIndex = templates.pairIndex(pattern, word)
+        start = (partIndex - pairIndex) % partCount
+        middle = word if '{word}' in pattern else ''
+        if not checked[pairIndex]:
+            checked[pairIndex] = True
+            pairClashes = {}
+            for baseIndex in range(start, len(uniqueBases), partCount):
+                before, _, after = pieces[pattern][baseIndex]
+                label = before + middle + after
+                sharing = []
+                for otherPattern, otherPieces in pieces.items():
+                    otherBefore, hasWord, otherAfter = otherPieces[baseIndex]
+                    if otherPattern == pattern:
+                        continue
+                    if not hasWord:
+                        if label == otherBefore:
+                            sharing.append((otherPattern, ''))
+                    elif len(label) >= len(otherBefore) + len(otherAfter) and label.startswith(otherBefore) and label.endswith(otherAfter):
+                        otherWord = label[len(otherBefore):len(label) - len(otherAfter)]
+                        if otherWord in templates.wordIndexes:
+                            sharing.append((otherPattern, otherWord))
+                if sharing:
+                    pairClashes[baseIndex] = sharing
+            if pairClashes:
+                clashes[pairIndex] = pairClashes
+        pairClashes = clashes.get(pairIndex, {})
+        key = templates.key(pattern, word, domain)
+        for baseIndex in range(start, len(uniqueBases), partCount):
+            sharing = pairClashes.get(baseIndex)
+            if sharing and any((templates.key(otherPattern, otherWord, domain) or key) < key for otherPattern, otherWord in sharing):
+                if stats is not None:
+                    stats.duplicates += 1
+                continue
+            before, _, after = pieces[pattern][baseIndex]
+            label = before + middle + after
+            if not rule.fullmatch(label):
+                if stats is not None:
+                    stats.invalid += 1
+            else:
+                if stats is not None:
+                    stats.generated += 1
+                yield f'{label}.{domain}'
+
+# Names under the dependent suffixes for every hit that resolved under their root suffix
+def dependentCandidates(hits):
+    for name in hits:
+        label, domain = name.split('.', 1)
+        for dependent, root in suffixDependencies.items():
+            if root == domain and namingRules.get(dependent, dnsLabel).fullmatch(label):
+                yield f'{label}.{dependent}'
+
+# Wraps a first pass's name source, counting in stats.dependable the names the dependent suffixes would add for every
+# name it makes, so pruning can be reported without generating the dependent names too.
+# With a shard, only the names this node would look up are counted
+class DependentCount:
+    def __init__(self, nameSource, dependentSuffixes, shard=None):
+        self.nameSource = nameSource
+        self.shard = shard
+        self.rules = {} # root suffix -> naming rules of its dependent suffixes
+        for dependent in dependentSuffixes:
+            self.rules.setdefault(suffixDependencies[dependent], []).append(namingRules.get(dependent, dnsLabel))
+
+    def __call__(self, stats=None, part=None):
+        for name in self.nameSource(stats=stats, part=part):
+            if stats is not None:
+                label, domain = name.split('.', 1)
+                rules = self.rules.get(domain)
+                if rules and (not self.shard or inShard(name, self.shard)):
+                    stats.dependable += sum(1 for rule in rules if rule.fullmatch(label))
+            yield name
+
+# Walks the same generator without keeping anything, so the total is exact after filtering
+def countCandidates(names):
+    count = 0
+    for _ in names:
+        count += 1
+    return count
+
+# Names subdomainCandidates or templateCandidates make before invalid names and duplicates are dropped,
+# worked out without generating any, e.g. for a progress total while the real count isn't known yet
+def estimateSubdomainCandidates(bases, suffixes, patterns, words):
+    return countCandidates(bases) * len(suffixes) * (1 + len(patterns) * len(words))
+
+# part works as for subdomainCandidates, dealing out the labels of the base in turn
+def storageAccountCandidates(base, words, domain, stats=None, part=None):
+    partIndex, partCount = part or (0, 1)
+    labels = [base] if base else []
+    if base:
+        for pattern in ['{base}{word}','{word}{base}']:
+            for word in words:
+                labels.append(pattern.format(word=word, base=base))
+    else:
+        labels += [word for word in words if word]
+    seen = set()
+    for position, label in enumerate(labels):
+        label = label.lower()
+        if label in seen:
+            if stats is not None and position % partCount == partIndex:
+                stats.duplicates += 1
+            continue
+        seen.add(label)
+        if position % partCount != partIndex:
+            continue
+        if not storageAccount.fullmatch(label):
+            if stats is not None:
+                stats.invalid += 1
+        else:
+            if stats is not None:
+                stats.generated += 1
+            yield label + domain
+
+# Storage account names for several bases, e.g. for a processes worker to regenerate.
+# Each base starts dealing its labels at the next part, so a worker's share evens out across bases
+def accountCandidates(bases, words, domain, stats=None, part=None):
+    partIndex, partCount = part or (0, 1)
+    for baseIndex, base in enumerate(bases):
+        yield from storageAccountCandidates(base, words, domain, stats, ((partIndex - baseIndex) % partCount, partCount))
+
+# The same estimate for accountCandidates
+def estimateAccountCandidates(bases, words):
+    return sum(1 + 2 * len(words) if base else len(words) for base in bases)
+
+# A list of names as a picklable name source, like the generators above
+def listCandidates(names, stats=None, part=None):
+    partIndex, partCount = part or (0, 1)
+    return iter(names[partIndex::partCount])
+
+# Lowercased, de-duplicated folder names that can be blob containers
+def validFolders(folders, stats=None):
+    output = {}
+    for folderName in folders:
+        folderName = folderName.strip().lower()
+        if not folderName:
+            continue
+        if folderName in output:
+            if stats is not None:
+                stats.duplicates += 1
+        elif not containerName.fullmatch(folderName):
+            if stats is not None:
+                stats.invalid += 1
+        else:
+            output[folderName] = None
+    return list(output)
+
+# Folders are the outer loop so consecutive guesses go to different accounts,
+# which keeps the per-account request cap from stalling the whole sweep on one account
+def containerCandidates(accounts, folders):
+    for folderName in folders:
+        for subDomain in accounts:
+            yield f'{subDomain}/{folderName}'.lower()
+
+# The same guesses for accounts that arrive on an asyncio.Queue while DNS is still running,
+# ending at a None. Accounts take turns one folder at a time, so a newly confirmed account
+# starts right away instead of waiting behind every folder of the ones before it.
+# An (account, folders) pair on the queue walks its own folders instead of the shared ones.
+# Accounts that show up in skipAccounts along the way are dropped with the rest of their folders
+async def streamContainerCandidates(accountQueue, folders, skipAccounts=()):
+    active = collections.deque()
+    finished = False
+    while True:
+        # Take every account confirmed so far, only waiting when there is nothing else to probe
+        while not finished:
+            if active:
+                try:
+                    account = accountQueue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+            else:
+                account = await accountQueue.get()
+            if account is None:
+                finished = True
+            elif isinstance(account, tuple):
+                account, accountFolders = account
+                active.append((account, iter(accountFolders)))
+            else:
+                active.append((account, iter(folders)))
+        if not active:
+            return
+        account, remaining = active.popleft()
+        if account in skipAccounts:
+            continue
+        folderName = next(remaining, None)
+        if folderName is not None:
+            active.append((account, remaining))
+            yield f'{account}/{folderName}'.lower()
+
+# --shard i/N: this node's share of the candidates, 1-based on the command line, 0-based here
+def shard(value):
+    index, _, count = value.partition('/')
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError(value)
+    return index - 1, count
+
+# crc32 rather than hash(), which changes between processes. Keyed on the first label, so the
+# dependent suffixes of a label and the container guesses of an account stay on the same shard as it
+def inShard(name, shard):
+    index, count = shard
+    return zlib.crc32(name.split('.', 1)[0].encode()) % count == index
+
+def shardCandidates(names, shard):
+    for name in names:
+        if inShard(name, shard):
+            yield name
+
+# Stops handing out names once maxNames have gone out or the deadline (a time.time()) has passed,
+# for runs that have to fit a query count or a time box. One budget covers every pass of a run
+class QueryBudget:
+    def __init__(self, maxNames=None, deadline=None):
+        self.maxNames = maxNames
+        self.deadline = deadline
+        self.used = 0
+        self.exhausted = None # 'queries' or 'time' once a limit has held names back
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        return None if self.maxNames is None else max(0, self.maxNames - self.used)
+
+    def check(self):
+        if self.maxNames is not None and self.used >= self.maxNames:
+            self.exhausted = 'queries'
+        elif self.deadline is not None and time.time() >= self.deadline:
+            self.exhausted = 'time'
+        return self.exhausted
+
+    # Counts one name against the budget, or returns False once it is spent
+    def take(self):
+        with self.lock:
+            if self.check():
+                return False
+            self.used += 1
+            return True
+
+    def limit(self, names):
+        for name in names:
+            if not self.take():
+                return
+            yield name
+
+    # Ends names once the budget is spent, without counting them, for a producer that runs ahead of take()
+    def until(self, names):
+        for name in names:
+            if self.exhausted:
+                return
+            yield name
+
+# Producer side of a bounded queue.Queue: blocks whenever the workers fall behind,
+# then sends one None per worker so they know to stop. Once stopped (a threading.Event) is set, no more names go in
+def feedQueue(names, workQueue, numWorkers, stopped=None):
+    def feed():
+        for name in names:
+            if stopped is not None and stopped.is_set():
+                break
+            workQueue.put(name)
+        for _ in range(numWorkers):
+            workQueue.put(None)
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    return feeder
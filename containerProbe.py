@@ -0,0 +1,329 @@
+# Container probing for enumerateAzureBlobs.py
+# One pooled aiohttp session with keep-alive and a DNS cache, and a scheduler that keeps
+# many requests in flight while capping the total and each storage account separately.
+# Listings are parsed as they stream in and followed across NextMarker pages,
+# so memory per container stays constant however many blobs it holds.
+# Each guess costs a single List Blobs request, and an account whose error code rules out
+# anonymous access to every container gets no further requests.
+
+import asyncio
+import collections
+import contextlib
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+import aiohttp
+
+from containerState import ADDED, REMOVED, UNCHANGED, GONE, FAILED
+
+DONE = object() # marks the end of the results in the shared queue
+
+# x-ms-error-code values that hold for every container on the account, not just the one asked for
+ACCOUNT_ERRORS = {
+    'PublicAccessNotPermitted', # anonymous access is turned off for the whole account
+    'AccountIsDisabled',
+    'AuthorizationFailure' # firewall or network rules keep anonymous callers out
+}
+
+
+# Storage accounts ruled out for anonymous access, with the error code that ruled each one out.
+# An account is only held for maxAge seconds, since its owner may open it up later, and the oldest go first
+# once there are more than maxEntries, so a long-lived process doesn't keep every account it has ever seen
+class DeadAccounts:
+    def __init__(self, maxAge=24*60*60, maxEntries=100000):
+        self.maxAge = maxAge
+        self.maxEntries = maxEntries
+        self.entries = collections.OrderedDict() # account host -> (error code, ruledOutAt), oldest first
+
+    def add(self, account, errorCode):
+        if account in self:
+            return
+        self.entries[account] = (errorCode, time.time())
+        cutoff = time.time() - self.maxAge
+        while len(self.entries) > self.maxEntries or next(iter(self.entries.values()))[1] <= cutoff:
+            self.entries.popitem(last=False)
+
+    def __contains__(self, account):
+        entry = self.entries.get(account)
+        if entry is None:
+            return False
+        if entry[1] <= time.time() - self.maxAge:
+            del self.entries[account]
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# The first List Blobs page was refused for good, with a 404 or an account-wide error code,
+# so the guess isn't a public container
+class NotListable(Exception):
+    pass
+
+
+# A List Blobs page failed in a way that may not last, like throttling or a server error,
+# or a page after the first one failed, so the listing can't be trusted to be complete
+class ListingFailed(Exception):
+    pass
+
+
+# The first List Blobs page answered a conditional request with 304
+class NotModified(Exception):
+    pass
+
+
+class ContainerProber:
+    def __init__(self, concurrency=200, perAccount=16, timeout=15.0, connectTimeout=5.0, endpoint=None):
+        self.concurrency = max(1, concurrency)
+        self.endpoint = endpoint.rstrip('/') if endpoint else None # path-style base URL, e.g. a local fake Blob service
+        self.perAccount = max(1, perAccount)
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connectTimeout)
+        self.accountSlots = {} # storage account host -> [asyncio.Semaphore, guesses holding or waiting for it]
+        self.deadAccounts = DeadAccounts()
+        self.errorCodes = collections.Counter()
+        self.requests = 0
+        self.bytesRead = 0 # listing bytes received
+        self.journal = None # optional scanJournal.ScanJournal that finished guesses and their results go to
+        self.state = None # optional containerState.ContainerState that every listed container is recorded in
+        self.session = None
+        self.loop = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # The session and the per-account semaphores belong to the loop they were made on
+        if self.session is not None and self.loop is not loop:
+            self.session = None
+            self.accountSlots = {}
+        if self.session is None:
+            self.loop = loop
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.perAccount,
+                                             ttl_dns_cache=300, keepalive_timeout=30)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # Holds one of the account's request slots. The account's semaphore is dropped once no guess holds or waits for it,
+    # so only the accounts being probed right now are kept
+    @contextlib.asynccontextmanager
+    async def slots(self, account):
+        if account not in self.accountSlots:
+            self.accountSlots[account] = [asyncio.Semaphore(self.perAccount), 0]
+        slot = self.accountSlots[account]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if not slot[1] and self.accountSlots.get(account) is slot:
+                del self.accountSlots[account]
+
+    def containerUrl(self, dirGuess):
+        if self.endpoint:
+            return f'{self.endpoint}/{dirGuess}'
+        return f'https://{dirGuess}'
+
+    # Counts why a container wasn't listable and rules out the account if the reason covers all of it.
+    # Returns whether the answer is definitive; anything but a 404 or an account-wide code may be worth asking again
+    def classify(self, account, response):
+        errorCode = response.headers.get('x-ms-error-code') or f'HTTP {response.status}'
+        self.errorCodes[errorCode] += 1
+        if errorCode in ACCOUNT_ERRORS:
+            self.deadAccounts.add(account, errorCode)
+            return True
+        return response.status == 404
+
+    # Streams the blob names of a public container, one List Blobs page after another.
+    # Each <Blob> is dropped from the tree as soon as its name is read. Only a definitive refusal of the first page
+    # raises NotListable; any other failed page raises ListingFailed, so a cut-off listing never passes for a whole one.
+    # headers go with the first page only, e.g. conditional ones, and validators gets its ETag and Last-Modified
+    async def listBlobs(self, account, containerUrl, headers=None, validators=None):
+        marker = ''
+        while True:
+            listUrl = f'{containerUrl}?restype=container&comp=list'
+            if marker:
+                listUrl += '&marker=' + urllib.parse.quote(marker, safe='')
+            self.requests += 1
+            async with self.session.get(listUrl, headers=None if marker else headers) as fileListRequest:
+                if fileListRequest.status == 304 and not marker:
+                    raise NotModified()
+                if fileListRequest.status != 200:
+                    if self.classify(account, fileListRequest) and not marker:
+                        raise NotListable()
+                    raise ListingFailed()
+                if validators is not None and not marker:
+                    validators['etag'] = fileListRequest.headers.get('ETag')
+                    validators['lastModified'] = fileListRequest.headers.get('Last-Modified')
+                parser = ET.XMLPullParser(events=('start', 'end'))
+                blobsElement = None
+                marker = ''
+                async for chunk in fileListRequest.content.iter_chunked(65536):
+                    self.bytesRead += len(chunk)
+                    parser.feed(chunk)
+                    for event, element in parser.read_events():
+                        if event == 'start':
+                            if element.tag == 'Blobs':
+                                blobsElement = element
+                        elif element.tag == 'Blob':
+                            name = element.findtext('Name')
+                            if blobsElement is not None:
+                                blobsElement.remove(element)
+                            if name is not None:
+                                yield name
+                        elif element.tag == 'NextMarker':
+                            marker = element.text or ''
+                parser.close()
+            if not marker:
+                return
+
+    def found(self, dirGuess, blobUrl):
+        if self.journal:
+            self.journal.recordFound(dirGuess, blobUrl)
+        return dirGuess, blobUrl
+
+    # Checks one account/folder guess, yielding (dirGuess, blob URL) pairs as the listing streams in.
+    # A public container with no blobs yields a single pair with a URL of None.
+    async def probe(self, dirGuess):
+        account = dirGuess.split('/')[0]
+        async with self.slots(account):
+            # Checked again here since the account may have been ruled out while this guess waited for a slot
+            if account in self.deadAccounts:
+                return
+            validators = {}
+            listed = False
+            try:
+                empty = True
+                async for name in self.listBlobs(account, self.containerUrl(dirGuess), validators=validators):
+                    empty = False
+                    if self.state:
+                        self.state.addName(dirGuess, name)
+                    yield self.found(dirGuess, f'https://{dirGuess}/{name}')
+                if empty:
+                    yield self.found(dirGuess, None)
+                if self.state:
+                    self.state.finishListing(dirGuess, validators.get('etag'), validators.get('lastModified'), diff=False)
+                listed = True
+            except NotListable:
+                pass
+            except (aiohttp.ClientError, asyncio.TimeoutError, ET.ParseError, ListingFailed):
+                return # no definitive answer, so a resumed run tries it again
+            finally:
+                # A listing cut short, by an error or by the consumer stopping early, isn't recorded
+                if self.state and not listed:
+                    self.state.discardListing(dirGuess)
+            if self.journal:
+                self.journal.record(dirGuess, '')
+
+    # Re-checks a container from the state store, yielding (kind, dirGuess, blob URL) changes.
+    # The listing is asked for with the validators it last came back with; a 304 skips it entirely.
+    # Otherwise it streams into the store and only the blobs added or removed since last time come out.
+    # Only a definitive refusal makes it GONE, and one for the whole account does so for every container on it;
+    # a listing that fails any other way is FAILED and the stored one stays
+    async def rescan(self, dirGuess):
+        account = dirGuess.split('/')[0]
+        async with self.slots(account):
+            if account in self.deadAccounts:
+                self.state.forget(dirGuess)
+                yield GONE, dirGuess, None
+                return
+            validators = {}
+            try:
+                async for name in self.listBlobs(account, self.containerUrl(dirGuess), self.state.conditionalHeaders(dirGuess), validators):
+                    self.state.addName(dirGuess, name)
+            except NotModified:
+                self.state.unchanged(dirGuess)
+                yield UNCHANGED, dirGuess, None
+                return
+            except NotListable:
+                self.state.forget(dirGuess)
+                yield GONE, dirGuess, None
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError, ET.ParseError, ListingFailed):
+                self.state.discardListing(dirGuess) # tried again on the next re-scan
+                yield FAILED, dirGuess, None
+                return
+            except BaseException:
+                self.state.discardListing(dirGuess)
+                raise
+            added, removed = self.state.finishListing(dirGuess, validators.get('etag'), validators.get('lastModified'))
+        if not added and not removed:
+            yield UNCHANGED, dirGuess, None
+        for name in added:
+            yield ADDED, dirGuess, f'https://{dirGuess}/{name}'
+        for name in removed:
+            yield REMOVED, dirGuess, f'https://{dirGuess}/{name}'
+
+    # Probes an iterable or async iterable of guesses, pulled lazily so at most `concurrency`
+    # are outstanding, and yields (dirGuess, blob URL) pairs as they are found.
+    # probe replaces self.probe for each guess, e.g. self.rescan, and whatever it yields is passed on. Guesses are pulled
+    # by a separate task, so results keep flowing while a streaming source waits for more input.
+    # Guesses on accounts already ruled out are dropped unprobed, unless skipDead is off so probe can report them.
+    # The result queue is bounded, so a huge listing waits for the consumer instead of piling up in memory.
+    async def probeMany(self, dirGuesses, probe=None, skipDead=True):
+        probe = probe or self.probe
+        await self.start()
+        results = asyncio.Queue(maxsize=1000)
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        async def probeInto(dirGuess):
+            try:
+                async for pair in probe(dirGuess):
+                    await results.put(pair)
+            finally:
+                slots.release()
+
+        async def feed():
+            try:
+                async for dirGuess in iterateAsync(dirGuesses):
+                    if skipDead and dirGuess.split('/')[0] in self.deadAccounts:
+                        continue
+                    await slots.acquire()
+                    task = asyncio.ensure_future(probeInto(dirGuess))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                # Every slot back means every probe has finished
+                for _ in range(self.concurrency):
+                    await slots.acquire()
+            finally:
+                await results.put(DONE)
+
+        feeder = asyncio.ensure_future(feed())
+        try:
+            while True:
+                pair = await results.get()
+                if pair is DONE:
+                    break
+                yield pair
+            await feeder # re-raises anything the guess source raised
+        finally:
+            feeder.cancel()
+            for task in tasks:
+                task.cancel()
+
+
+    def summary(self):
+        reasons = ', '.join(f'{count} {errorCode}' for errorCode, count in self.errorCodes.most_common())
+        return (f'{self.requests} container requests ({reasons or "no errors"}), {self.bytesRead / 1e6:.1f} MB of listings, '
+                f'{len(self.deadAccounts)} accounts ruled out for anonymous access')
+
+
+async def iterateAsync(items):
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
@@ -0,0 +1,120 @@
+# Known public containers for enumerateAzureBlobs.py --rescan
+# Every public container a scan lists is kept in SQLite with the validators its listing came back with
+# (ETag, Last-Modified) and its blob names. A re-scan sends the validators as conditional headers and,
+# when the listing comes back anyway, diffs it against the stored names on disk, so neither side of
+# the diff has to fit in memory
+
+import os
+import sqlite3
+import threading
+import time
+
+# Kinds of change a re-scan finds, as ContainerProber.rescan yields them in (kind, dirGuess, blob URL) tuples
+ADDED = 'added'
+REMOVED = 'removed'
+UNCHANGED = 'unchanged' # the whole container; blob URL is None
+GONE = 'gone' # the container can't be listed anymore; blob URL is None
+FAILED = 'failed' # the listing failed in a way that may not last, so the stored one stays; blob URL is None
+
+
+class ContainerState:
+    def __init__(self, path, batchSize=1000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.batchSize = batchSize
+        self.lock = threading.Lock()
+        self.pendingNames = {} # container -> names of the listing in progress not written yet
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS containers (
+                                    container TEXT PRIMARY KEY,
+                                    etag TEXT,
+                                    lastModified TEXT,
+                                    blobCount INTEGER NOT NULL,
+                                    checkedAt REAL NOT NULL)''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                                    container TEXT NOT NULL,
+                                    name TEXT NOT NULL,
+                                    PRIMARY KEY (container, name)) WITHOUT ROWID''')
+        # Listings in progress; several containers can be streaming in at once
+        self.connection.execute('''CREATE TEMP TABLE listing (
+                                    container TEXT NOT NULL,
+                                    name TEXT NOT NULL,
+                                    PRIMARY KEY (container, name)) WITHOUT ROWID''')
+        self.connection.commit()
+
+    # Every known container, as account/container guesses like the ones a scan makes
+    def known(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT container FROM containers ORDER BY container')]
+
+    # Conditional request headers from the container's last listing
+    def conditionalHeaders(self, container):
+        with self.lock:
+            row = self.connection.execute('SELECT etag, lastModified FROM containers WHERE container = ?', (container,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def addName(self, container, name):
+        names = self.pendingNames.setdefault(container, [])
+        names.append((container, name))
+        if len(names) >= self.batchSize:
+            self.writeNames(container)
+
+    def writeNames(self, container):
+        names = self.pendingNames.pop(container, None)
+        if names:
+            with self.lock:
+                self.connection.executemany('INSERT OR IGNORE INTO listing VALUES (?, ?)', names)
+
+    # Drops a listing that didn't finish, keeping what was known before
+    def discardListing(self, container):
+        self.pendingNames.pop(container, None)
+        with self.lock:
+            self.connection.execute('DELETE FROM listing WHERE container = ?', (container,))
+            self.connection.commit()
+
+    # The listing answered 304, so only the time it was checked changes
+    def unchanged(self, container):
+        with self.lock:
+            self.connection.execute('UPDATE containers SET checkedAt = ? WHERE container = ?', (time.time(), container))
+            self.connection.commit()
+
+    # Makes the finished listing the container's inventory. With diff, returns (added, removed) blob names
+    def finishListing(self, container, etag=None, lastModified=None, diff=True):
+        self.writeNames(container)
+        added = removed = []
+        with self.lock:
+            execute = self.connection.execute
+            if diff:
+                added = [row[0] for row in execute('''SELECT name FROM listing WHERE container = ?
+                                                      EXCEPT SELECT name FROM blobs WHERE container = ?''', (container, container))]
+                removed = [row[0] for row in execute('''SELECT name FROM blobs WHERE container = ?
+                                                        EXCEPT SELECT name FROM listing WHERE container = ?''', (container, container))]
+            execute('''DELETE FROM blobs WHERE container = ?
+                       AND name NOT IN (SELECT name FROM listing WHERE container = ?)''', (container, container))
+            execute('INSERT OR IGNORE INTO blobs SELECT container, name FROM listing WHERE container = ?', (container,))
+            blobCount = execute('SELECT COUNT(*) FROM listing WHERE container = ?', (container,)).fetchone()[0]
+            execute('DELETE FROM listing WHERE container = ?', (container,))
+            execute('INSERT OR REPLACE INTO containers VALUES (?, ?, ?, ?, ?)', (container, etag, lastModified, blobCount, time.time()))
+            self.connection.commit()
+        return added, removed
+
+    # A container that can't be listed anymore is forgotten, so later re-scans don't ask again
+    def forget(self, container):
+        self.pendingNames.pop(container, None)
+        with self.lock:
+            self.connection.execute('DELETE FROM listing WHERE container = ?', (container,))
+            self.connection.execute('DELETE FROM blobs WHERE container = ?', (container,))
+            self.connection.execute('DELETE FROM containers WHERE container = ?', (container,))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,109 @@
+# Persistent DNS result cache shared by enumerateAzureSubDomains.py and enumerateAzureBlobs.py
+# Stores found addresses and NXDOMAINs in SQLite so repeat scans only query names that expired or were never seen
+
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+
+class DnsCache:
+    def __init__(self, path, maxAge=14*24*60*60, maxEntries=5000000, batchSize=500):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.maxAge = maxAge
+        self.maxEntries = maxEntries
+        self.batchSize = batchSize
+        self.lock = threading.Lock()
+        self.pendingWrites = []
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS results (
+                                    name TEXT PRIMARY KEY,
+                                    address TEXT NOT NULL,
+                                    resolvedAt REAL NOT NULL)''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS resultsAge ON results (resolvedAt)')
+        self.connection.commit()
+
+    # returns the cached IP, '' for a cached NXDOMAIN, or None if the name has to be queried
+    def get(self, name):
+        with self.lock:
+            row = self.connection.execute('SELECT address FROM results WHERE name = ? AND resolvedAt > ?',
+                                          (name, time.time() - self.maxAge)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    # Only definitive answers belong here: an address, or '' for NXDOMAIN/no A record
+    def put(self, name, address):
+        with self.lock:
+            self.pendingWrites.append((name, address, time.time()))
+            if len(self.pendingWrites) >= self.batchSize:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.pendingWrites:
+            self.connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', self.pendingWrites)
+            self.connection.commit()
+            self.pendingWrites = []
+
+    # Drops expired entries, then the oldest ones until the cache is back under maxEntries
+    def evict(self):
+        with self.lock:
+            self._flush()
+            self.connection.execute('DELETE FROM results WHERE resolvedAt <= ?', (time.time() - self.maxAge,))
+            excess = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.maxEntries
+            if excess > 0:
+                self.connection.execute('''DELETE FROM results WHERE name IN
+                                           (SELECT name FROM results ORDER BY resolvedAt LIMIT ?)''', (excess,))
+            self.connection.commit()
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.connection.close()
+
+
+# Same get/put as DnsCache but held in memory, for a long-lived process like the daemon where it outlives every job.
+# The least recently used entries go first once there are more than maxEntries
+class MemoryDnsCache:
+    path = None # nothing on disk for worker processes to open
+
+    def __init__(self, maxAge=14*24*60*60, maxEntries=1000000):
+        self.maxAge = maxAge
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict() # name -> (address, resolvedAt)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or entry[1] <= time.time() - self.maxAge:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(name)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, name, address):
+        with self.lock:
+            self.entries[name] = (address, time.time())
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+    def close(self):
+        pass
@@ -7,36 +7,26 @@
 
 #import socket
 import time
+import atexit
 import argparse
-import urllib
-import xml.etree.ElementTree as ET
 import os
-import threading
 import asyncio
-from functools import reduce
 
 try:
-    import dns.resolver
-    import requests
-    import aiohttp
+    from dnsCache import DnsCache
+    from resolverPool import readResolverSpecs
+    import scanStats
+    from scanJournal import ScanJournal
+    from pycroburst import BlobEnumerator, ACCOUNT, RESOLVED
+    from containerState import ContainerState, ADDED, UNCHANGED, GONE, FAILED
+    from outputSink import OutputSink, FORMATS
+    from candidates import shard
+    from bingSearch import BingSearch, SearchCache, BING_ENDPOINT
 except ModuleNotFoundError:
     print('Use `pip install -r requirements.txt` to install the required modules to use this script')
     exit()
 
 
-def resolveDnsName(name):
-    try:
-        #return socket.gethostbyname(name)
-        return dns.resolver.resolve(name)[0].address
-    except:
-        return ''
-
-def checkDnsAndAdd(name):
-    if resolveDnsName(name):
-        print(f'Found Storage Account - {name}')
-        runningList.append(name)
-        return name
-
 def chooseFromBing(bingList):
     output = []
     choiceList = []
@@ -67,46 +57,102 @@ def chooseFromBing(bingList):
                 continue
     return output
 
-def processDnsChunk(start,stop):
-    for i in range(start,stop):
-        lookup = lookupList[i]
-        checkDnsAndAdd(lookup)
-
-async def aioProcessContainerChunk(start, stop, session):
-    writeToOutput=[]
-    for i in range(start,stop):
-        dirGuess = dirList[i]
-        uriGuess = f'https://{dirGuess}?restype=container'
-        try:
-            #guessRequest = requests.get(uriGuess)
-            async with session.get(uriGuess) as guessRequest:
-                if guessRequest.status == 200:
-                    uriList = f'https://{dirGuess}?restype=container&comp=list'
-                    #fileListRequest = requests.get(uriList)
-                    async with session.get(uriList) as fileListRequest:
-                        fileListXML = ET.fromstring(await fileListRequest.text())
-                        if len(fileListXML[0]) > 0:
-                            for blob in fileListXML[0]:
-                                foundPath = blob.find('Name').text
-                                print(f'Public File Available: https://{dirGuess}/{foundPath}')
-                                writeToOutput.append(f'https://{dirGuess}/{foundPath}')
-                        else:
-                            print(f'Empty Public Container Available: {uriList}')
-                            writeToOutput.append(f'https://{uriList}')
-        except:
-            continue
-    return writeToOutput
-
+# Every account and container the search turns up, for the picker
+async def searchBing():
+    hosts = set() # Using sets to prevent duplicates
+    containers = set()
+    async for host, container in bingSearch.discover(bingQuery):
+        hosts.add(host)
+        if container:
+            containers.add(container)
+    return sorted(hosts), containers
+
+# Prints results as they stream in: accounts as DNS confirms them, then public containers and blobs.
+# Each public file or empty container goes straight to the output file, so none are kept in memory.
+# Results replayed from a resumed journal were written when they were found, so they are only printed,
+# and so are the ones a listing cut off in the earlier run turns up again
 async def aioMain():
-    calls = []
-    print('Length of dirList: ' + str(len(dirList)))
-    async with aiohttp.ClientSession() as session:
-        for t in range(numThreads):
-            start = int(len(dirList) * t / numThreads)
-            stop = int(len(dirList) * (t+1) / numThreads)
-            print(f'Calling aioProcessContainerChunk with start: {start} and stop: {stop}')
-            calls.append(aioProcessContainerChunk(start, stop, session))
-        return await asyncio.gather(*calls)
+    def report(dirGuess, blobUrl, replayed=False):
+        replayed = replayed or (journal is not None and journal.foundBefore(dirGuess, blobUrl))
+        account, container = dirGuess.split('/', 1)
+        if blobUrl:
+            print(f'Public File Available: {blobUrl}')
+            record = {'url': blobUrl, 'type': 'blob'}
+        else:
+            uriList = f'https://{dirGuess}?restype=container&comp=list'
+            print(f'Empty Public Container Available: {uriList}')
+            record = {'url': uriList, 'type': 'container'}
+        if outputSink and not replayed:
+            record.update(account=account.split('.')[0], container=container)
+            outputSink.write(record)
+
+    if journal:
+        for dirGuess, blobUrl in journal.found:
+            report(dirGuess, blobUrl, replayed=True)
+    runStats.start()
+    accountCount = 0
+    try:
+        # With --bing-all, search results go to probing as the pages arrive
+        discovered = bingSearch.discover(bingQuery) if bingSearch and args.bing_all else None
+        async for kind, name, blobUrl in enumerator.enumerate([base], bingAccounts, bingContainers, discovered=discovered):
+            if kind == ACCOUNT:
+                accountCount += 1
+                print(f'Found Storage Account - {name}')
+            elif kind == RESOLVED:
+                # DNS is done while probing carries on, so its numbers are final now
+                runStats.stop()
+                print(enumerator.candidateStats.report())
+                if dnsCache:
+                    dnsCache.close()
+                print(runStats.summary())
+                runStats.writeJson()
+            else:
+                report(name, blobUrl)
+        print(enumerator.prober.summary())
+        if discovered:
+            print(bingSearch.summary())
+    finally:
+        await enumerator.close()
+    print('Length of dirList: ' + str(accountCount * len(enumerator.folders)))
+
+# Re-checks the containers in the state store instead of enumerating, reporting only the blobs that changed
+async def aioRescan():
+    containerCount = len(containerState.known())
+    changedContainers = set()
+    unchangedCount = goneCount = failedCount = addedCount = removedCount = 0
+    try:
+        async for kind, dirGuess, blobUrl in enumerator.rescan():
+            account, container = dirGuess.split('/', 1)
+            if kind == UNCHANGED:
+                unchangedCount += 1
+                continue
+            # Throttled or cut off part way; the stored listing stays for the next re-scan
+            if kind == FAILED:
+                failedCount += 1
+                continue
+            if kind == GONE:
+                goneCount += 1
+                uriList = f'https://{dirGuess}?restype=container&comp=list'
+                print(f'Container No Longer Public: {uriList}')
+                record = {'url': uriList, 'type': kind}
+            else:
+                changedContainers.add(dirGuess)
+                if kind == ADDED:
+                    addedCount += 1
+                    print(f'New Public File: {blobUrl}')
+                else:
+                    removedCount += 1
+                    print(f'Removed Public File: {blobUrl}')
+                record = {'url': blobUrl, 'type': kind}
+            if outputSink:
+                record.update(account=account.split('.')[0], container=container)
+                outputSink.write(record)
+        print(f'Rescanned {containerCount} containers: {unchangedCount} unchanged, {len(changedContainers)} changed '
+              f'({addedCount} blobs added, {removedCount} removed), {goneCount} no longer public, '
+              f'{failedCount} could not be listed and are kept for the next re-scan')
+        print(enumerator.prober.summary())
+    finally:
+        await enumerator.close()
 
 if __name__ == '__main__':
     startTime = time.perf_counter()
@@ -126,39 +172,175 @@ if __name__ == '__main__':
                         help='Specific folders file to use. Default is permutations.txt (included in this repo)')
 
     parser.add_argument('-o', '--output',
-                        help='The file to write out your results to')
+                        help='The file to write out your results to. Results are appended as they are found.')
+
+    parser.add_argument('--format',
+                        help='Format of the output file: text (one URL per line), jsonl or csv. Default is text.',
+                        choices=FORMATS, default='text')
+
+    parser.add_argument('--flush-interval',
+                        help='Most seconds a result waits in the buffer before it is written to the output file. Default is 1.',
+                        type=float, default=1.0)
 
     parser.add_argument('-bk', '--bingkey',
                         help='The Bing API Key to use for base name searches.')
 
+    parser.add_argument('--bing-all',
+                        help='Probe every storage account the Bing search finds as results come in, instead of choosing from a list once the search is done.',
+                        action='store_true')
+
+    parser.add_argument('--bing-depth',
+                        help='Most pages of 50 Bing results to fetch, all at once after the first. Default is 5.',
+                        type=int, default=5)
+
+    parser.add_argument('--bing-endpoint',
+                        help=f'Bing Web Search endpoint. Default is {BING_ENDPOINT}. For testing against a local stand-in.',
+                        default=BING_ENDPOINT)
+
+    parser.add_argument('--bing-cache',
+                        help='Bing result cache file shared between runs. Default is bingCache.sqlite next to this script.')
+
+    parser.add_argument('--no-bing-cache',
+                        help='Disable the Bing result cache and always call the API.',
+                        action='store_true')
+
+    parser.add_argument('--bing-cache-max-age',
+                        help='Seconds a cached Bing result page stays valid. Default is 604800 (7 days).',
+                        type=int, default=7*24*60*60)
+
+    parser.add_argument('--state',
+                        help='File to record every public container found in, with its listing validators and blob names, for --rescan.')
+
+    parser.add_argument('--rescan',
+                        help='Re-check the containers recorded in --state instead of enumerating: unchanged ones are skipped, and for changed ones only the blobs added or removed are reported.',
+                        action='store_true')
+
     parser.add_argument('-t', '--threads',
                         help='Specify the number of threads to use. Default is 10.',
                         type=int, default=10)
 
+    parser.add_argument('--http-concurrency',
+                        help='Maximum number of container requests in flight. Default is 200.',
+                        type=int, default=200)
+
+    parser.add_argument('--per-account',
+                        help='Maximum number of container requests in flight to any one storage account. Default is 16.',
+                        type=int, default=16)
+
+    parser.add_argument('--http-timeout',
+                        help='Timeout in seconds for each container request. Default is 15.',
+                        type=float, default=15.0)
+
+    parser.add_argument('--blob-endpoint',
+                        help='Send container requests to this base URL, path-style (e.g. http://127.0.0.1:10000 requests http://127.0.0.1:10000/account.blob.core.windows.net/container), instead of to each account. For testing against a local Blob service.')
+
+    parser.add_argument('-l', '--library',
+                        help='Specify which library to use for the DNS lookups. Default is threading.',
+                        choices=['threading','asyncio','udp','processes'], default='threading')
+
+    parser.add_argument('-c', '--concurrency',
+                        help='Maximum number of DNS queries in flight for the asyncio and udp libraries, and for each worker of the processes library. Default is 1000.',
+                        type=int, default=1000)
+
+    parser.add_argument('--processes',
+                        help='Number of DNS worker processes for the processes library. Default is the number of CPUs.',
+                        type=int, default=os.cpu_count())
+
+    parser.add_argument('--timeout',
+                        help='Per-query DNS timeout in seconds. Default is 2.',
+                        type=float, default=2.0)
+
+    parser.add_argument('--retries',
+                        help='Number of retries for DNS queries that time out or fail, each on a different resolver where possible. Default is 2.',
+                        type=int, default=2)
+
+    parser.add_argument('--max-concurrency',
+                        help='Upper bound the DNS thread count (-t) or in-flight queries (-c) may grow to while latency and errors stay healthy. Default is 8 times the starting value.',
+                        type=int)
+
+    parser.add_argument('--fixed-concurrency',
+                        help='Keep the DNS thread count or in-flight queries fixed instead of adapting to resolver health.',
+                        action='store_true')
+
+    parser.add_argument('--resolvers',
+                        help='Comma separated DNS resolvers (host or host:port), or a file with one per line, to spread queries across. Default is the system resolver.')
+
+    parser.add_argument('--resolver-rate',
+                        help='Maximum queries per second sent to each resolver. Default is unlimited.',
+                        type=float, default=0)
+
+    parser.add_argument('--resolver-max-inflight',
+                        help='Maximum queries outstanding at each resolver. Default is unlimited.',
+                        type=int, default=0)
+
+    parser.add_argument('--sockets',
+                        help='Number of UDP sockets the udp library multiplexes queries over. Default is 4.',
+                        type=int, default=4)
+
+    parser.add_argument('--cache',
+                        help='DNS result cache file shared between runs. Default is dnsCache.sqlite next to this script.')
+
+    parser.add_argument('--no-cache',
+                        help='Disable the DNS result cache and query every name.',
+                        action='store_true')
+
+    parser.add_argument('--cache-max-age',
+                        help='Seconds a cached DNS result stays valid. Default is 1209600 (14 days).',
+                        type=int, default=14*24*60*60)
+
+    parser.add_argument('--stats-json',
+                        help='File to write a time series of DNS throughput, latency and error counts to, for comparing runs.')
+
+    parser.add_argument('--shard',
+                        help='Only scan this node\'s share of the storage accounts and their containers, e.g. 2/4 for the second of four nodes. Every node gets a disjoint, stable share; combine their output files with mergeResults.py.',
+                        type=shard, metavar='I/N')
+
+    parser.add_argument('--journal',
+                        help='File to append finished lookups, container guesses and results to as the scan goes, so an interrupted run can be picked up with --resume.')
+
+    parser.add_argument('--resume',
+                        help='Journal from an interrupted run: work it finished is skipped and its results are printed again, but not written to the output file again. New progress is appended to it.')
+
     args = parser.parse_args()
 
     base = args.base
     numThreads = args.threads
 
+    if args.rescan and not args.state:
+        print('--rescan needs the --state file of an earlier scan')
+        exit()
+
     scriptDirectory = os.path.dirname(os.path.realpath(__file__))
 
     if args.permutations:
         permutationsFilePath = args.permutations
     else:
-        permutationsFilePath = scriptDirectory + '\\permutations.txt'
+        permutationsFilePath = os.path.join(scriptDirectory, 'permutations.txt')
 
     if args.folders:
         folderFilePath = args.folders
     else:
-        folderFilePath = scriptDirectory + '\\permutations.txt'
+        folderFilePath = os.path.join(scriptDirectory, 'permutations.txt')
 
     outputFile = args.output
+
+    # Opened before the scan, so a bad path fails now rather than after the whole enumeration
+    outputSink = None
+    if outputFile:
+        try:
+            outputSink = OutputSink(outputFile, ('url', 'type', 'account', 'container'), format=args.format, flushInterval=args.flush_interval)
+        except OSError:
+            print(f'Error writing to file: {outputFile}')
+            exit()
+        atexit.register(outputSink.close)
+
+    dnsCache = None
+    if not args.no_cache:
+        dnsCache = DnsCache(args.cache or os.path.join(scriptDirectory, 'dnsCache.sqlite'), maxAge=args.cache_max_age)
     bingAPIKey = args.bingkey
 
-    domain = '.blob.core.windows.net'
-    runningList = []
+    bingAccounts = []
     folderList = []
-    bingList = set() #Using sets to prevent duplicates
     bingContainers = set()
 
     if permutationsFilePath and os.path.isfile(permutationsFilePath):
@@ -168,50 +350,40 @@ if __name__ == '__main__':
     else:
         print('No permutations file found')
         exit()
-    
-    lookupList = []
-    if base:
-        lookup = (base+domain).lower()
-        lookupList.append(lookup)
-        for pattern in ['{base}{word}','{word}{base}']:
-            for word in permutationContent:
-                lookup = (pattern.format(word=word, base=base) + domain).lower()
-                lookupList.append(lookup)
-    else:
-        for word in permutationContent:
-            lookup = (word + domain).lower()
-            lookupList.append(lookup)
-    
-    #Thread the DNS lookups and filter them into the runningList
-    dnsThreads = []
-    for i in range(numThreads):
-        start = int( len(lookupList) * i / numThreads )
-        stop = int( len(lookupList) * (i+1) / numThreads )
-        dnsThreads.append(threading.Thread(target=processDnsChunk, args=(start,stop)))
-        dnsThreads[i].start()
-    for thread in dnsThreads:
-        thread.join()
-
-    if bingAPIKey and base:
-        bingQuery = urllib.parse.quote('site:blob.core.windows.net '+base)
-        try: 
-            response = requests.get(f'https://api.bing.microsoft.com/v7.0/search?q={bingQuery}&count=50',
-                                    headers={'Ocp-Apim-Subscription-Key': bingAPIKey})
-            response.raise_for_status()
-            webSearch = response.json()
-        except:
-            print('Error getting Bing API response')
-
-        if 'webPages' in webSearch:
-            for searchResults in webSearch['webPages']['value']:
-                urlSplit = urllib.parse.urlsplit(searchResults['url'])
-                bingList.add(urlSplit.netloc) # host name of URL
-                bingContainers.add(urlSplit.path.split('/')[1]) # first entry in path
-            runningList += chooseFromBing(bingList)
-            for folderName in bingContainers:
-                folderList.append(folderName)
-        else:
-            print('No results from Bing search')
+
+    # Found accounts are printed as they come in, so no progress line for the DNS phase
+    runStats = scanStats.ScanStats(showProgress=False, statsPath=args.stats_json)
+
+    # Flushed in batches as the scan goes, and once more on the way out, even after Ctrl-C
+    journal = None
+    if args.journal or args.resume:
+        journal = ScanJournal(args.resume or args.journal, resume=bool(args.resume))
+        atexit.register(journal.close)
+
+    if os.name == 'nt': # Windows fix
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    containerState = None
+    if args.state:
+        containerState = ContainerState(args.state)
+        atexit.register(containerState.close)
+
+    bingSearch = None
+    if bingAPIKey and base and not args.rescan:
+        bingCache = None
+        if not args.no_bing_cache:
+            bingCache = SearchCache(args.bing_cache or os.path.join(scriptDirectory, 'bingCache.sqlite'), maxAge=args.bing_cache_max_age)
+            atexit.register(bingCache.close)
+        bingSearch = BingSearch(bingAPIKey, endpoint=args.bing_endpoint, depth=args.bing_depth, cache=bingCache, warn=print)
+        bingQuery = 'site:blob.core.windows.net ' + base
+        # The picker needs every result before it can ask, so only --bing-all gets to stream them
+        if not args.bing_all:
+            bingList, bingContainers = asyncio.run(searchBing())
+            print(bingSearch.summary())
+            if bingList:
+                bingAccounts = chooseFromBing(bingList)
+            else:
+                print('No results from Bing search')
 
     folderFile = open(folderFilePath)
     folderContent = folderFile.readlines()
@@ -219,27 +391,32 @@ if __name__ == '__main__':
     for folderName in folderContent:
         folderList.append(folderName.strip())
 
-    dirList = []
-    for subDomain in runningList:
-        for folderName in folderList:
-            dirGuess = f'{subDomain}/{folderName}'.lower()
-            dirList.append(dirGuess)
-    
-    #Thread the folder check on the storage accounts found
-    if os.name == 'nt': # Windows fix
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    loop = asyncio.get_event_loop()
-    aTemp = loop.run_until_complete(aioMain())
-    writeToOutput = reduce(lambda x,y: x+y, aTemp) # flatten the list of lists into one list
-    
-    try:
-        fileObject = open(outputFile, 'a')
-        for data in writeToOutput:
-            fileObject.write(data + '\n')
-        fileObject.close()
-    except:
-        print(f'Error writing to file: {outputFile}')
-
+    # Names that can't be storage accounts or containers and duplicates are dropped before any request.
+    # -t or -c is where DNS concurrency starts; it grows while things are healthy and backs off on timeouts and SERVFAILs
+    enumerator = BlobEnumerator(permutationContent, folderList, httpConcurrency=args.http_concurrency, perAccount=args.per_account,
+                                httpTimeout=args.http_timeout, blobEndpoint=args.blob_endpoint, library=args.library,
+                                concurrency=args.concurrency, threads=numThreads, maxConcurrency=args.max_concurrency,
+                                adaptive=not args.fixed_concurrency, timeout=args.timeout, retries=args.retries,
+                                resolvers=readResolverSpecs(args.resolvers) if args.resolvers else None,
+                                resolverRate=args.resolver_rate, resolverMaxInFlight=args.resolver_max_inflight, sockets=args.sockets,
+                                processes=args.processes, cache=dnsCache, journal=journal, stats=runStats, shard=args.shard,
+                                state=containerState, warn=print)
+
+    if args.rescan:
+        asyncio.run(aioRescan())
+        if dnsCache:
+            dnsCache.close()
+    else:
+        #Look up storage accounts and check their folders as they are found
+        asyncio.run(aioMain())
+    if journal:
+        journal.close()
+        if args.resume:
+            print(journal.report())
+
+    if outputSink:
+        outputSink.close()
+        print(f'{outputSink.count} results written to {outputFile}')
 
     print()
     print(f'Time taken: {time.perf_counter() - startTime}')
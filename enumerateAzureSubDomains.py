@@ -7,16 +7,22 @@
 # Ported into Python by Ben Jensen
 
 import socket
+import atexit
 import os
 import argparse
 import time
-import threading
 import asyncio
-from concurrent import futures
 
 try:
-    import dns.resolver
     from tabulate import tabulate # for printing a pretty table
+    from dnsCache import DnsCache
+    from resolverPool import readResolverSpecs
+    import scanStats
+    from scanJournal import ScanJournal
+    from hitHistory import HitHistory
+    from pycroburst import SubdomainEnumerator, serviceOf
+    from outputSink import OutputSink, FORMATS
+    from candidates import BaseFile, QueryBudget, cleanBase, shard
 except ModuleNotFoundError:
     print('Use `pip install -r requirements.txt` to install the required modules to use this script')
     exit()
@@ -31,84 +37,23 @@ def socketResolveDnsName(name):
     except:
         return ''
 
-def resolveDnsName(name):
+# Hands each hit to the output file as it's found, and keeps it only when the table needs it.
+# Hits replayed from a resumed journal were written when they were found, so they only go to the table
+def addHit(name, service, replayed=False):
+    if verbose:
+        print(f'VERBOSE: Found {name}')
+    if outputSink and not replayed:
+        outputSink.write({'name': name, 'service': service})
+    if not args.no_table:
+        temp.append((name, service))
+
+# The engine, pool and cache are only needed for this one call
+async def enumerateSubdomains(enumerator, bases):
     try:
-        answer = dns.resolver.resolve(name)
-        return answer[0].address
-    except:
-        return ''
-
-# saves the domain to our temp list if it exists
-def checkDns(name):
-    # This oneliner removes the lowest subdomain
-    # e.g. "test.blob.core.windows.net" becomes "blob.core.windows.net"
-    domain = '.'.join(name.split('.')[1:])
-    if resolveDnsName(name):
-        temp.append((name, subLookup[domain]))
-
-# Function for threading chunks of the domainNames list
-def accumulateDnsHits(chunk):
-    global iterations
-    for domain in chunk:
-        iterations += 1
-        checkDns(domain)
-
-def progressBar():
-    width = os.get_terminal_size().columns
-    while iterations<numDomains:
-        progressBarWidth = width-7-2*len(str(numDomains))
-        print(f'[%s] [%s]'%
-              (('o'*int(progressBarWidth*iterations/numDomains))
-              .ljust(progressBarWidth),
-               f'{iterations}/{numDomains}'.rjust(1+2*len(str(numDomains)))),
-              end='\r')
-    print(' '*width, end='')
-    return
-
-# Start the asynchronous tasks
-async def asyncResolveDnsName(name): 
-    try:
-        ip = dns.resolver.resolve(name)[0].address
-        if verbose:
-            print(f'VERBOSE: Found {name}')
-        return name
-    except:
-        return ''
-
-#Asyncio library helpers
-async def asyncResolveChunk(start,stop):
-    global iterations
-    chunk = []
-    for index in range(start,stop):
-        iterations += 1
-        name = await asyncResolveDnsName(domainNames[index])
-        if name:
-            chunk.append(name)
-    return chunk
-
-async def main():
-    calls = []
-    for t in range(numThreads):
-        start = int(numDomains * t / numThreads)
-        stop = int(numDomains * (t+1) / numThreads)
-        calls.append(asyncResolveChunk(start,stop))
-    return await asyncio.gather(*calls)
-
-##async def main():
-##    calls=[]
-##    for domain in domainNames:
-##        calls.append(asyncResolveDnsName(domain))
-##    return await asyncio.gather(*calls)
-
-#Using futures
-def processChunk(start,stop):
-    global iterations
-    output = []
-    for index in range(start,stop):
-        iterations+=1
-        if resolveDnsName(domainNames[index]):
-            output.append(domainNames[index])
-    return output
+        async for name, service in enumerator.enumerate(bases):
+            addHit(name, service)
+    finally:
+        await enumerator.close()
 
 
 if __name__=='__main__':
@@ -118,42 +63,61 @@ if __name__=='__main__':
     baseGroup = parser.add_mutually_exclusive_group(required=True)
     baseGroup.add_argument('-b', '--base', help='The Base name to prepend/append with permutations.')
     baseGroup.add_argument('-bf', '--basefile', help='Specific file with list of base names to use.')
-    parser.add_argument('-o', '--output', help='File where data will be output.')
+    parser.add_argument('-o', '--output', help='File where data will be output. Hits are appended as they are found.')
+    parser.add_argument('--format', help='Format of the output file: text (one subdomain per line), jsonl or csv. Default is text.', choices=FORMATS, default='text')
+    parser.add_argument('--flush-interval', help='Most seconds a hit waits in the buffer before it is written to the output file. Default is 1.', type=float, default=1.0)
+    parser.add_argument('--no-table', help='Skip the table of every hit at the end, so hits are not kept in memory. Use -v or -o to see them.', action='store_true')
     parser.add_argument('-p', '--permutations', help='Specific permutations file to use. Default is permutations.txt (included in this repo)')
     parser.add_argument('-t', '--threads', help='Specify the number of threads to use. Default is 10.', type=int)
-    parser.add_argument('-l', '--library', help='Specify which threading library to use. Default is threading.', choices=['none','threading','asyncio','futures'], default='threading')
+    parser.add_argument('-l', '--library', help='Specify which threading library to use. Default is threading.', choices=['none','threading','asyncio','futures','udp','processes'], default='threading')
+    parser.add_argument('-c', '--concurrency', help='Maximum number of DNS queries in flight for the asyncio and udp libraries, and for each worker of the processes library. Default is 1000.', type=int, default=1000)
+    parser.add_argument('--processes', help='Number of worker processes for the processes library. Default is the number of CPUs.', type=int, default=os.cpu_count())
+    parser.add_argument('--timeout', help='Per-query DNS timeout in seconds. Default is 2.', type=float, default=2.0)
+    parser.add_argument('--retries', help='Number of retries for DNS queries that time out or fail, each on a different resolver where possible. Default is 2.', type=int, default=2)
+    parser.add_argument('--resolvers', help='Comma separated DNS resolvers (host or host:port), or a file with one per line, to spread queries across. Default is the system resolver.')
+    parser.add_argument('--resolver-rate', help='Maximum queries per second sent to each resolver. Default is unlimited.', type=float, default=0)
+    parser.add_argument('--resolver-max-inflight', help='Maximum queries outstanding at each resolver. Default is unlimited.', type=int, default=0)
+    parser.add_argument('--max-concurrency', help='Upper bound the thread count (-t) or in-flight queries (-c) may grow to while latency and errors stay healthy. Default is 8 times the starting value.', type=int)
+    parser.add_argument('--fixed-concurrency', help='Keep the thread count or in-flight queries fixed instead of adapting to resolver health.', action='store_true')
+    parser.add_argument('--sockets', help='Number of UDP sockets the udp library multiplexes queries over. Default is 4.', type=int, default=4)
+    parser.add_argument('--cache', help='DNS result cache file shared between runs. Default is dnsCache.sqlite next to this script.')
+    parser.add_argument('--no-cache', help='Disable the DNS result cache and query every name.', action='store_true')
+    parser.add_argument('--cache-max-age', help='Seconds a cached DNS result stays valid. Default is 1209600 (14 days).', type=int, default=14*24*60*60)
+    parser.add_argument('--history', help='File of hit statistics per permutation word, pattern and service, kept across runs and used to try the likeliest names first. Default is hitHistory.sqlite next to this script.')
+    parser.add_argument('--no-history', help='Neither record nor use hit statistics, and try the names base by base in permutations file order.', action='store_true')
+    parser.add_argument('--max-queries', help='Stop after looking up this many names. With the hit history, the likeliest names are the ones covered.', type=int)
+    parser.add_argument('--time-budget', help='Stop looking up new names this many seconds after the lookups start. Lookups already in flight still finish.', type=float)
+    parser.add_argument('--no-prune', help='Query every service suffix for every name, even when the storage account or web app it depends on does not resolve.', action='store_true')
+    parser.add_argument('--stats-json', help='File to write a time series of throughput, latency and error counts to, for comparing runs.')
+    parser.add_argument('--shard', help='Only scan this node\'s share of the names, e.g. 2/4 for the second of four nodes. Every node gets a disjoint, stable share; combine their output files with mergeResults.py.', type=shard, metavar='I/N')
+    parser.add_argument('--journal', help='File to append finished names and hits to as the scan goes, so an interrupted run can be picked up with --resume.')
+    parser.add_argument('--resume', help='Journal from an interrupted run: names it finished are skipped and its hits are added to the table, but not written to the output file again. New progress is appended to it.')
     parser.add_argument('-v', '--verbose', help='Verbose output flag. If enabled, the domains will be output as they are found.',
                         action='store_true')
     args = parser.parse_args()
 
-    #track how many iterations are done for the progress bar
-    iterations = 0
-
     # default values
     outputFilePath = ''
-    permutationsFilePath = os.path.dirname(os.path.realpath(__file__)) + '\\permutations.txt'
+    permutationsFilePath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'permutations.txt')
     numThreads = 10
     verbose = False
     library = args.library
 
+    dnsCache = None
+    if not args.no_cache:
+        dnsCache = DnsCache(args.cache or os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dnsCache.sqlite'), maxAge=args.cache_max_age)
+
+    # Bases from a file are streamed rather than read into memory
     if args.base:
-        baseList = [args.base]
+        baseList = [cleanBase(args.base, print)]
 
     if args.basefile:
         if os.path.isfile(args.basefile):
-            baseFile = open(args.basefile)
-            baseList = baseFile.readlines()
-            baseFile.close()
+            baseList = BaseFile(args.basefile, print)
         else:
             print('No base file found')
             exit()
 
-    for i in range(len(baseList)):
-        if '.' in baseList[i]:
-            print(f'Invalid base parameter: {baseList[i]}. Removing periods from base.')
-            baseList[i] = baseList[i].replace('.','')
-        baseList[i] = baseList[i].strip()
-
     if args.output:
         outputFilePath = args.output
 
@@ -170,29 +134,31 @@ if __name__=='__main__':
         print(f'Invalid thread count: {numThreads}. Defaulting back to 5.')
         numThreads = 5 
 
-    temp = [] # stores Subdomains and their Service as tuple pairs
-
-    # Domain = Service dictionary for easier lookups
-    subLookup = {
-        'onmicrosoft.com':'Microsoft Hosted Domain',
-        'scm.azurewebsites.net':'App Services - Management',
-        'azurewebsites.net':'App Services',
-        'p.azurewebsites.net':'App Services',
-        'cloudapp.net':'App Services',
-        'file.core.windows.net':'Storage Accounts - Files',
-        'blob.core.windows.net':'Storage Accounts - Blobs',
-        'queue.core.windows.net':'Storage Accounts - Queues',
-        'table.core.windows.net':'Storage Accounts - Tables',
-        'mail.protection.outlook.com':'Email',
-        'sharepoint.com':'SharePoint',
-        'redis.cache.windows.net':'Databases-Redis',
-        'documents.azure.com':'Databases-Cosmos DB',
-        'database.windows.net':'Databases-MSSQL',
-        'vault.azure.net':'Key Vaults',
-        'azureedge.net':'CDN',
-        'search.windows.net':'Search Appliance',
-        'azure-api.net':'API Services'
-    }
+    temp = [] # stores Subdomains and their Service as tuple pairs, for the table
+
+    # Opened before the scan, so a bad path fails now rather than after hours of lookups
+    outputSink = None
+    if outputFilePath:
+        try:
+            outputSink = OutputSink(outputFilePath, ('name', 'service'), format=args.format, flushInterval=args.flush_interval)
+        except OSError:
+            print(f'Unable to write to {outputFilePath}')
+            exit()
+        atexit.register(outputSink.close)
+
+    # Flushed in batches as the scan goes, and once more on the way out, even after Ctrl-C
+    journal = None
+    if args.journal or args.resume:
+        journal = ScanJournal(args.resume or args.journal, resume=bool(args.resume))
+        atexit.register(journal.close)
+        for hit, _ in journal.hits:
+            addHit(hit, serviceOf(hit), replayed=True)
+
+    # Saved on the way out too, so an interrupted run still counts
+    hitHistory = None
+    if not args.no_history:
+        hitHistory = HitHistory(args.history or os.path.join(os.path.dirname(os.path.realpath(__file__)), 'hitHistory.sqlite'))
+        atexit.register(hitHistory.close)
 
     # Load permutation words from file
     try:
@@ -209,125 +175,58 @@ if __name__=='__main__':
         print('Error loading permutations file')
         exit()
 
-    # List of all domain names
-    domainNames = []
-
-    # Patterns for joining the permutations with the base
-    patternList = ('{word}-{base}','{base}-{word}','{word}{base}','{base}{word}')
-
-
-    # Generate list of all domains that this script will check
-    for base in baseList:
-        for domain in subLookup.keys():
-            domainNames.append(f'{base}.{domain}')
-            for pattern in patternList:
-                for word in permutationContent:
-                    domainNames.append(pattern.format(word=word, base=base) + '.' + domain)
-
-
-    numDomains = len(domainNames)
-
-    #-------------------------
-    #Threading
-
-    threads = []
-
-    if library=='threading':
-        # Start the threads!
-        for i in range(numThreads):
-            start = int(numDomains*i/numThreads)
-            stop = int(numDomains*(i+1)/numThreads)
-            threads.append(threading.Thread(target=accumulateDnsHits, args=[domainNames[start:stop]]))
-            threads[i].start()
-
-        # The progress bar doesn't play well with other print statements
-        # So it's disabled if verbose mode is active
-        if not verbose:
-            progressBarThread = threading.Thread(target=progressBar, args=[])
-            progressBarThread.start()
-
-        for thread in threads:
-            thread.join()
-
-        if not verbose:
-            progressBarThread.join()
-    #------------------------------
-
-    #------------------------
-    #Asyncio
-    if library=='asyncio':
-        if not verbose:
-            progressBarThread = threading.Thread(target=progressBar)
-            progressBarThread.start()
-        loop = asyncio.get_event_loop()
-        aTemp = loop.run_until_complete(main())
-        aTemp = list(filter(lambda domain: domain!='', aTemp))
-        for chunks in aTemp:
-            for domain in chunks:
-                temp.append(
-                    (domain,
-                    subLookup['.'.join(domain.split('.')[1:])]
-                    )
-                )
-        progressBarThread.join()
-    #------------------------
-
-    #--------------------
-    #Using Futures
-
-    if library=='futures':
-        fTemp = []
-        with futures.ThreadPoolExecutor(max_workers=numThreads) as executor:
-            future_dnsresolve = []
-            if not verbose:
-                progressBarThread = threading.Thread(target=progressBar)
-                progressBarThread.start()
-            for i in range(numThreads):
-                start = int(numDomains * i / numThreads)
-                stop = int(numDomains * (i+1) / numThreads)
-                future_dnsresolve.append(executor.submit(processChunk, start, stop))
-            for future in futures.as_completed(future_dnsresolve):
-                fTemp = fTemp + future.result()
-        if not verbose:
-            progressBarThread.join()
-        for domain in fTemp:
-            temp.append(
-                (domain,
-                subLookup['.'.join(domain.split('.')[1:])]
-                )
-            )
-    #------------------------
-
-    #------------------------------
-    #Without any threading
-
-    if library=='none':
-        if not verbose:
-            progressBarThread = threading.Thread(target=progressBar)
-            progressBarThread.start()
-        for domain in domainNames:
-            iterations+=1
-            if resolveDnsName(domain):
-                temp.append(
-                    (domain,
-                    subLookup['.'.join(domain.split('.')[1:])]
-                    )
-                )
-        if not verbose:
-            progressBarThread.join()
-    #----------------------------------
+    # Deadline from when the lookups are about to start, so opening the cache, history and word lists doesn't use up the time box
+    budget = None
+    if args.max_queries is not None or args.time_budget is not None:
+        budget = QueryBudget(args.max_queries, time.time() + args.time_budget if args.time_budget is not None else None)
+
+    # The progress display doesn't play well with other print statements
+    # So it's only drawn if verbose mode is off, but stats are collected either way
+    runStats = scanStats.ScanStats(showProgress=not verbose, statsPath=args.stats_json)
+    enumerator = SubdomainEnumerator(permutationContent, prune=not args.no_prune, library=library, concurrency=args.concurrency,
+                                     threads=numThreads, maxConcurrency=args.max_concurrency, adaptive=not args.fixed_concurrency,
+                                     timeout=args.timeout, retries=args.retries,
+                                     resolvers=readResolverSpecs(args.resolvers) if args.resolvers else None,
+                                     resolverRate=args.resolver_rate, resolverMaxInFlight=args.resolver_max_inflight, sockets=args.sockets,
+                                     processes=args.processes, cache=dnsCache, journal=journal, stats=runStats, shard=args.shard,
+                                     history=hitHistory, budget=budget, warn=print)
+
+    # The progress total starts out as an estimate and becomes exact once every name has been generated
+    runStats.start()
+    asyncio.run(enumerateSubdomains(enumerator, baseList))
+    runStats.stop()
+    # Names Azure can't register and duplicates are dropped while generating
+    print(enumerator.candidateStats.report())
+    if not args.no_prune:
+        print(f'Pruned {enumerator.pruned} queries for services whose root name did not resolve')
+    namesDone = runStats.merged().done
+    if budget and budget.exhausted and namesDone < runStats.total:
+        limit = '--max-queries' if budget.exhausted == 'queries' else '--time-budget'
+        order = 'likeliest first' if hitHistory else 'in permutations file order'
+        # Names past the limit are never generated, so the total is the estimate
+        print(f'Stopped at the {limit} limit: covered {namesDone} of about {runStats.total} names ({namesDone / runStats.total:.1%}), {order}')
 
     # This prints it out tabulated (pretty table) and sorted by the 2nd element (services)
-    print(tabulate(sorted(temp, key=lambda s: s[1]), headers=['Subdomain','Service']))
-    print('\n')
+    if not args.no_table:
+        print(tabulate(sorted(temp, key=lambda s: s[1]), headers=['Subdomain','Service']))
+        print('\n')
 
-    if outputFilePath:
-        try:
-            outputFile = open(outputFilePath, 'a')
-            for hit,_ in temp:
-                outputFile.write(hit + '\n')
-            outputFile.close()
-        except:
-            print(f'Unable to write to {outputFile}')
+    if outputSink:
+        outputSink.close()
+        print(f'{outputSink.count} hits written to {outputFilePath}')
+
+    if dnsCache:
+        dnsCache.close()
+
+    if hitHistory:
+        hitHistory.close()
+
+    if journal:
+        journal.close()
+        if args.resume:
+            print(journal.report())
+
+    print(runStats.summary())
+    runStats.writeJson()
 
     print(f'Total runtime: {time.perf_counter() - startTime} seconds')
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+
+# Long-running enumeration service for pipelines that fire many small scans
+# Imports, word lists, resolver sockets, the DNS result cache and the HTTP connection pool are set up once
+# and stay warm between jobs. Jobs are JSON POSTs to a local HTTP port or Unix socket, and results stream
+# back as JSON lines while the job runs:
+#
+#   curl -N -d '{"bases": ["contoso"]}' http://127.0.0.1:8642/subdomains
+#   curl -N --unix-socket /tmp/pycroburst.sock -d '{"bases": ["contoso"], "folders": ["backup"]}' http://localhost/blobs
+#
+# Jobs running at the same time split one DNS concurrency budget evenly, and their container requests
+# share one connection pool, so a big job can't starve the small ones
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+try:
+    from aiohttp import web
+    from adaptiveLimit import AdaptiveLimit, FairShare
+    from dnsCache import MemoryDnsCache
+    from hitHistory import HitHistory
+    from resolverPool import ResolverPool, readResolverSpecs
+    from pycroburst import SubdomainEnumerator, BlobEnumerator, ACCOUNT, BLOB
+    from candidates import cleanBase
+except ModuleNotFoundError:
+    print('Use `pip install -r requirements.txt` to install the required modules to use this script')
+    exit()
+
+
+class JobError(Exception):
+    pass
+
+
+def readLines(path):
+    with open(path) as lineFile:
+        return [line.strip() for line in lineFile if line.strip()]
+
+# Checks a job body: bases is required, the other lists are optional and replace the daemon's defaults
+async def readJob(request, listFields):
+    try:
+        job = await request.json()
+    except ValueError:
+        raise JobError('Body must be a JSON object')
+    if not isinstance(job, dict):
+        raise JobError('Body must be a JSON object')
+    for field in ('bases',) + listFields:
+        value = job.get(field)
+        if value is not None and not (isinstance(value, list) and all(isinstance(item, str) for item in value)):
+            raise JobError(f'{field} must be a list of strings')
+    bases = [cleanBase(base) for base in job.get('bases') or []]
+    if not any(bases):
+        raise JobError('bases must have at least one name')
+    job['bases'] = [base for base in bases if base]
+    return job
+
+# Streams one JSON line per result; the final line sums up the job
+async def streamJob(request, results, describe):
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    started = time.perf_counter()
+    count = 0
+    jobs['running'] += 1
+    try:
+        async for result in results:
+            line = describe(result)
+            if line:
+                count += 1
+                await response.write((json.dumps(line) + '\n').encode())
+        await response.write((json.dumps({'done': True, 'results': count, 'seconds': round(time.perf_counter() - started, 3)}) + '\n').encode())
+    finally:
+        # Also reached when the client hangs up, so the job's lookups and requests stop with it
+        await results.aclose()
+        jobs['running'] -= 1
+        jobs['finished'] += 1
+    await response.write_eof()
+    return response
+
+async def subdomainJob(request):
+    try:
+        job = await readJob(request, ('words', 'services'))
+    except JobError as error:
+        return web.json_response({'error': str(error)}, status=400)
+    with fairShare.join() as share:
+        results = subdomains.enumerate(job['bases'], words=job.get('words'), services=job.get('services'), share=share)
+        try:
+            return await streamJob(request, results, lambda hit: {'name': hit[0], 'service': hit[1]})
+        finally:
+            # Saved after every job, so the next one ranks with it and a crash loses at most one job's answers
+            if hitHistory:
+                hitHistory.save()
+
+def describeBlobResult(result):
+    kind, name, url = result
+    if kind == ACCOUNT:
+        return {'type': 'account', 'name': name}
+    if kind == BLOB:
+        if url:
+            return {'type': 'blob', 'container': name, 'url': url}
+        return {'type': 'container', 'container': name, 'url': f'https://{name}?restype=container&comp=list'}
+    return None
+
+async def blobJob(request):
+    try:
+        job = await readJob(request, ('words', 'folders', 'accounts'))
+    except JobError as error:
+        return web.json_response({'error': str(error)}, status=400)
+    with fairShare.join() as share:
+        results = blobs.enumerate(job['bases'], accounts=job.get('accounts') or (), folders=job.get('folders') or defaultFolders,
+                                  words=job.get('words'), share=share)
+        return await streamJob(request, results, describeBlobResult)
+
+async def status(request):
+    merged = subdomains.stats.merged()
+    return web.json_response({
+        'jobsRunning': jobs['running'],
+        'jobsFinished': jobs['finished'],
+        'names': merged.done,
+        'hits': merged.hits,
+        'cacheEntries': len(dnsCache.entries),
+        'cacheHits': dnsCache.hits,
+        'concurrency': limiter.current(),
+        'containerRequests': blobs.prober.requests,
+        'deadAccounts': len(blobs.prober.deadAccounts)
+    })
+
+async def closeEnumerators(app):
+    await subdomains.close()
+    await blobs.close()
+    if hitHistory:
+        hitHistory.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the subdomain and blob enumerations as a resident service, so repeated small jobs reuse warm resolvers, caches and connections.')
+    parser.add_argument('--host', help='Address to listen on. Default is 127.0.0.1.', default='127.0.0.1')
+    parser.add_argument('--port', help='HTTP port to listen on. Default is 8642.', type=int, default=8642)
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of a TCP port.')
+    parser.add_argument('-p', '--permutations', help='Default permutations file for jobs that send no words. Default is permutations.txt (included in this repo)')
+    parser.add_argument('-f', '--folders', help='Default folders file for blob jobs that send no folders. Default is the permutations file.')
+    parser.add_argument('--history', help='Hit statistics file, as kept by enumerateAzureSubDomains.py, to try the likeliest subdomains first and add every job\'s answers to. Default is none.')
+    parser.add_argument('-l', '--library', help='Specify which library to use for the DNS lookups. Default is udp.', choices=['asyncio','udp'], default='udp')
+    parser.add_argument('-c', '--concurrency', help='DNS queries in flight across all jobs to start from. Default is 1000.', type=int, default=1000)
+    parser.add_argument('--max-concurrency', help='Upper bound the DNS queries in flight across all jobs may grow to while latency and errors stay healthy. Default is 8 times -c.', type=int)
+    parser.add_argument('--fixed-concurrency', help='Keep the DNS queries in flight fixed instead of adapting to resolver health.', action='store_true')
+    parser.add_argument('--timeout', help='Per-query DNS timeout in seconds. Default is 2.', type=float, default=2.0)
+    parser.add_argument('--retries', help='Number of retries for DNS queries that time out or fail, each on a different resolver where possible. Default is 2.', type=int, default=2)
+    parser.add_argument('--resolvers', help='Comma separated DNS resolvers (host or host:port), or a file with one per line, to spread queries across. Default is the system resolver.')
+    parser.add_argument('--resolver-rate', help='Maximum queries per second sent to each resolver. Default is unlimited.', type=float, default=0)
+    parser.add_argument('--resolver-max-inflight', help='Maximum queries outstanding at each resolver. Default is unlimited.', type=int, default=0)
+    parser.add_argument('--sockets', help='Number of UDP sockets the udp library multiplexes queries over. Default is 4.', type=int, default=4)
+    parser.add_argument('--cache-max-age', help='Seconds a cached DNS result stays valid. Default is 1209600 (14 days).', type=int, default=14*24*60*60)
+    parser.add_argument('--cache-entries', help='Most DNS results kept in memory. Default is 1000000.', type=int, default=1000000)
+    parser.add_argument('--http-concurrency', help='Maximum number of container requests in flight across all jobs. Default is 200.', type=int, default=200)
+    parser.add_argument('--per-account', help='Maximum number of container requests in flight to any one storage account. Default is 16.', type=int, default=16)
+    parser.add_argument('--http-timeout', help='Timeout in seconds for each container request. Default is 15.', type=float, default=15.0)
+    parser.add_argument('--blob-endpoint', help='Send container requests to this base URL, path-style, instead of to each account. For testing against a local Blob service.')
+    args = parser.parse_args()
+
+    scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+    permutationsFilePath = args.permutations or os.path.join(scriptDirectory, 'permutations.txt')
+    folderFilePath = args.folders or permutationsFilePath
+    for path in (permutationsFilePath, folderFilePath):
+        if not os.path.isfile(path):
+            print(f'No file found: {path}')
+            exit()
+
+    # One resolver pool, limit and cache behind both kinds of job
+    pool = ResolverPool(readResolverSpecs(args.resolvers) if args.resolvers else None,
+                        rate=args.resolver_rate, maxInFlight=args.resolver_max_inflight)
+    limiter = AdaptiveLimit(args.concurrency, args.max_concurrency or args.concurrency*8, adaptive=not args.fixed_concurrency)
+    fairShare = FairShare(limiter)
+    dnsCache = MemoryDnsCache(maxAge=args.cache_max_age, maxEntries=args.cache_entries)
+    options = dict(library=args.library, concurrency=args.concurrency, timeout=args.timeout, retries=args.retries,
+                   sockets=args.sockets, cache=dnsCache, pool=pool, limiter=limiter, warn=print)
+    hitHistory = HitHistory(args.history) if args.history else None
+    subdomains = SubdomainEnumerator(readLines(permutationsFilePath), history=hitHistory, **options)
+    # A job's folders replace the defaults rather than adding to them
+    defaultFolders = readLines(folderFilePath)
+    blobs = BlobEnumerator(readLines(permutationsFilePath), [], httpConcurrency=args.http_concurrency,
+                           perAccount=args.per_account, httpTimeout=args.http_timeout, blobEndpoint=args.blob_endpoint,
+                           stats=subdomains.stats, **options)
+    jobs = {'running': 0, 'finished': 0}
+
+    if os.name == 'nt': # Windows fix
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    app = web.Application()
+    app.router.add_post('/subdomains', subdomainJob)
+    app.router.add_post('/blobs', blobJob)
+    app.router.add_get('/status', status)
+    app.on_cleanup.append(closeEnumerators)
+    print(f'Enumeration daemon listening on {args.socket or f"http://{args.host}:{args.port}"}', flush=True)
+    if args.socket:
+        web.run_app(app, path=args.socket, print=None)
+    else:
+        web.run_app(app, host=args.host, port=args.port, print=None)
@@ -0,0 +1,187 @@
+# Hit statistics for enumerateAzureSubDomains.py, kept across runs in SQLite
+# Every definitive answer is credited to the permutation word, pattern and subLookup suffix that made the name,
+# so later runs can try the candidates most likely to exist first instead of going through the words in file order
+
+import heapq
+import os
+import sqlite3
+import threading
+
+BASE_ONLY = '{base}' # the pattern for a base on its own, without a word
+
+
+class HitHistory:
+    # smoothing is how many tries of evidence a key needs before its own hit rate outweighs the overall one
+    def __init__(self, path, smoothing=20):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS hitStats (
+                                    kind TEXT NOT NULL,
+                                    key TEXT NOT NULL,
+                                    tries INTEGER NOT NULL,
+                                    hits INTEGER NOT NULL,
+                                    PRIMARY KEY (kind, key))''')
+        self.connection.commit()
+        # (kind, key) -> [tries, hits]; kind is 'word', 'pattern', 'suffix' or 'all'
+        self.counts = {(kind, key): [tries, hits] for kind, key, tries, hits in self.connection.execute('SELECT * FROM hitStats')}
+        self.pending = {} # counts from this run not saved yet
+        self.patterns = [] # (pattern, prefix, separator, suffix, word first) for telling which word and pattern made a label
+        self.words = set()
+        self.wordLengths = []
+
+    # Words and patterns that names will be credited to
+    def learn(self, patterns, words):
+        with self.lock:
+            known = {pattern for pattern, *_ in self.patterns}
+            for pattern in patterns:
+                if pattern in known or pattern.count('{word}') != 1 or pattern.count('{base}') != 1:
+                    continue
+                wordFirst = pattern.index('{word}') < pattern.index('{base}')
+                prefix, middle, suffix = pattern.replace('{base}', '{word}').split('{word}')
+                self.patterns.append((pattern, prefix.lower(), middle.lower(), suffix.lower(), wordFirst))
+            self.words.update(word.strip().lower() for word in words if word.strip())
+            self.wordLengths = sorted({len(word) for word in self.words}, reverse=True)
+
+    # (pattern, word) that most likely made label, preferring the longest word, or (BASE_ONLY, '') for a bare base
+    def attribute(self, label):
+        for length in self.wordLengths:
+            for pattern, prefix, middle, suffix, wordFirst in self.patterns:
+                if len(label) <= len(prefix) + len(middle) + len(suffix) + length or not label.startswith(prefix) or not label.endswith(suffix):
+                    continue
+                if wordFirst:
+                    word = label[len(prefix):len(prefix) + length]
+                    rest = label[len(prefix) + length:len(label) - len(suffix)]
+                    matched = rest.startswith(middle)
+                else:
+                    word = label[len(label) - len(suffix) - length:len(label) - len(suffix)]
+                    rest = label[len(prefix):len(label) - len(suffix) - length]
+                    matched = rest.endswith(middle)
+                if matched and word in self.words:
+                    return pattern, word
+        return BASE_ONLY, ''
+
+    # ip is the address for a hit or '' for a name that doesn't exist
+    def record(self, name, ip):
+        label, domain = name.lower().split('.', 1)
+        pattern, word = self.attribute(label)
+        keys = [('all', ''), ('pattern', pattern), ('suffix', domain)]
+        if word:
+            keys.append(('word', word))
+        with self.lock:
+            for key in keys:
+                counts = self.pending.setdefault(key, [0, 0])
+                counts[0] += 1
+                counts[1] += bool(ip)
+
+    # Hit rate across every name tried so far, with a small prior so an empty history still ranks
+    def baseRate(self):
+        tries, hits = self.counts.get(('all', ''), (0, 0))
+        return (hits + 1) / (tries + 100)
+
+    # Hit rate of one key, pulled toward the overall rate while it has few tries
+    def rate(self, kind, key, baseRate):
+        tries, hits = self.counts.get((kind, key), (0, 0))
+        return (hits + baseRate * self.smoothing) / (tries + self.smoothing)
+
+    # Every (pattern, word, suffix) template, likeliest first, as a RankedTemplates that makes them as it is iterated.
+    # A template's estimated chance to exist takes the three as independent: the pattern's and suffix's rates
+    # relative to the overall one, times the word's
+    def rank(self, patterns, words, suffixes):
+        baseRate = self.baseRate()
+        pairScores = {(pattern, domain): self.rate('pattern', pattern, baseRate) * self.rate('suffix', domain, baseRate) / baseRate
+                      for pattern in [BASE_ONLY] + list(patterns) for domain in suffixes}
+        return RankedTemplates(patterns, words, suffixes, pairScores, lambda word: self.rate('word', word, baseRate) / baseRate)
+
+    def save(self):
+        with self.lock:
+            if not self.pending:
+                return
+            self.connection.executemany('''INSERT INTO hitStats VALUES (?, ?, ?, ?)
+                                           ON CONFLICT (kind, key) DO UPDATE SET tries = tries + excluded.tries, hits = hits + excluded.hits''',
+                                        [(kind, key, tries, hits) for (kind, key), (tries, hits) in self.pending.items()])
+            self.connection.commit()
+            for key, (tries, hits) in self.pending.items():
+                counts = self.counts.setdefault(key, [0, 0])
+                counts[0] += tries
+                counts[1] += hits
+            self.pending = {}
+
+    def close(self):
+        if self.connection is None:
+            return
+        self.save()
+        with self.lock:
+            self.connection.close()
+            self.connection = None
+
+
+# Every (pattern, word, suffix) template in HitHistory.rank order, without holding them all: a score is a
+# (pattern, suffix) factor times a word factor, so the words are sorted once and each (pattern, suffix) walks them
+# in that order, and iterating merges those runs on score. Ties keep the order the lists give, so with no history
+# this is file order. Repeated words are dropped, leaving candidates.templateCandidates to count their templates
+# as duplicates. Picklable, so worker processes can each walk it
+class RankedTemplates:
+    def __init__(self, patterns, words, suffixes, pairScores, wordScore):
+        self.patterns = list(patterns)
+        self.suffixes = list(suffixes)
+        allWords = [word.strip().lower() for word in words]
+        self.words = list(dict.fromkeys(allWords))
+        self.repeats = len(allWords) - len(self.words)
+        self.pairScores = pairScores # (pattern or BASE_ONLY, suffix) -> score before the word's share
+        self.wordScores = [wordScore(word) if word else 1.0 for word in self.words]
+        self.wordOrder = sorted(range(len(self.words)), key=lambda index: -self.wordScores[index])
+        self.wordIndexes = {word: index for index, word in enumerate(self.words)}
+        self.patternIndexes = {pattern: index for index, pattern in enumerate(self.patterns)}
+        self.suffixIndexes = {domain: index for index, domain in enumerate(self.suffixes)}
+
+    # Templates there would be with the repeated words left in
+    def __len__(self):
+        return len(self.suffixes) * (1 + len(self.patterns) * (len(self.words) + self.repeats))
+
+    # Where a template sorts: likeliest first, then in list order. None for one that isn't ranked
+    def key(self, pattern, word, domain):
+        if domain not in self.suffixIndexes:
+            return None
+        if pattern == BASE_ONLY:
+            return -self.pairScores[(pattern, domain)], (self.suffixIndexes[domain], 0, 0)
+        if pattern not in self.patternIndexes or word not in self.wordIndexes:
+            return None
+        wordIndex = self.wordIndexes[word]
+        return (-(self.pairScores[(pattern, domain)] * self.wordScores[wordIndex]),
+                (self.suffixIndexes[domain], 1 + self.patternIndexes[pattern], wordIndex))
+
+    # A stable number for each (pattern, word), the same in every process
+    def pairIndex(self, pattern, word):
+        if pattern == BASE_ONLY:
+            return 0
+        return 1 + self.patternIndexes[pattern] * len(self.words) + self.wordIndexes[word]
+
+    def pairCount(self):
+        return 1 + len(self.patterns) * len(self.words)
+
+    def __iter__(self):
+        runs = [] # heap of (key, pattern, suffix, step along wordOrder or None for BASE_ONLY), one per run
+        for domain in self.suffixes:
+            runs.append((self.key(BASE_ONLY, '', domain), BASE_ONLY, domain, None))
+            if self.words:
+                for pattern in self.patterns:
+                    runs.append((self.key(pattern, self.words[self.wordOrder[0]], domain), pattern, domain, 0))
+        heapq.heapify(runs)
+        while runs:
+            _, pattern, domain, step = runs[0]
+            if step is None:
+                heapq.heappop(runs)
+                yield BASE_ONLY, '', domain
+                continue
+            word = self.words[self.wordOrder[step]]
+            if step + 1 < len(self.wordOrder):
+                nextWord = self.words[self.wordOrder[step + 1]]
+                heapq.heapreplace(runs, (self.key(pattern, nextWord, domain), pattern, domain, step + 1))
+            else:
+                heapq.heappop(runs)
+            yield pattern, word, domain
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+# Combines the output files of several enumerateAzureSubDomains.py or enumerateAzureBlobs.py runs,
+# e.g. one per --shard node, into the same report a single run prints
+
+import argparse
+import csv
+import json
+import os
+
+try:
+    from tabulate import tabulate # for printing a pretty table
+    from candidates import subLookup
+    from outputSink import OutputSink, FORMATS
+except ModuleNotFoundError:
+    print('Use `pip install -r requirements.txt` to install the required modules to use this script')
+    exit()
+
+# The records in one output file, as dicts in the order the run wrote them.
+# A text file holds only each record's first field; a jsonl line cut short by a crash is left out
+def readRecords(resultFile, format):
+    if format == 'csv':
+        yield from csv.DictReader(resultFile)
+        return
+    for line in resultFile:
+        line = line.strip()
+        if not line:
+            continue
+        if format == 'text':
+            yield {'result': line}
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+# Every distinct record across the files, keyed by its first field (the subdomain or blob URL), in the order first seen.
+# Returns the fields of the first record as well, so the merged file can be written with the same ones
+def readResults(paths, format='text'):
+    fields = None
+    results = {}
+    for path in paths:
+        with open(path, newline='' if format == 'csv' else None) as resultFile:
+            for record in readRecords(resultFile, format):
+                if not record:
+                    continue
+                fields = fields or tuple(record)
+                results.setdefault(next(iter(record.values())), record)
+    return fields or ('result',), results
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Merges the output files of several enumeration runs, such as one per --shard node, into one de-duplicated report.')
+    parser.add_argument('files', nargs='+', help='Output files to merge.')
+    parser.add_argument('-o', '--output', help='File where the merged results will be output, in the same format as the input files.')
+    parser.add_argument('--format', help='Format the files were written in with --format: text, jsonl or csv. Default is text.', choices=FORMATS, default='text')
+    args = parser.parse_args()
+
+    for path in args.files:
+        if not os.path.isfile(path):
+            print(f'No output file found: {path}')
+            exit()
+
+    fields, records = readResults(args.files, args.format)
+    results = list(records)
+
+    # Subdomain hits get the Subdomain/Service table; anything else, like blob URLs, is listed after it
+    subdomains = []
+    others = []
+    for result in results:
+        domain = '.'.join(result.split('.')[1:])
+        if domain in subLookup:
+            subdomains.append((result, subLookup[domain]))
+        else:
+            others.append(result)
+
+    if subdomains:
+        # Sorted by service like a single run, then by name so shard order doesn't matter
+        print(tabulate(sorted(subdomains, key=lambda s: (s[1], s[0])), headers=['Subdomain','Service']))
+        print('\n')
+    for result in sorted(others):
+        print(result)
+
+    print(f'{len(results)} results from {len(args.files)} files')
+
+    if args.output:
+        try:
+            outputSink = OutputSink(args.output, fields, format=args.format)
+        except OSError:
+            print(f'Unable to write to {args.output}')
+            exit()
+        for record in records.values():
+            outputSink.write(record)
+        outputSink.close()
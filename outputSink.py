@@ -0,0 +1,78 @@
+# Streaming result output for enumerateAzureSubDomains.py and enumerateAzureBlobs.py
+# Results are appended as they are found, in batches, so nothing has to be held until the end of the run
+
+import csv
+import io
+import json
+import threading
+import time
+
+FORMATS = ('text', 'jsonl', 'csv')
+
+
+# Writes result records, dicts with the given fields, as plain text, JSON lines or CSV.
+# Plain text is one line per record holding only the first field, the same as the scripts have always written.
+# A CSV header is only written when the file starts out empty, so appending to an earlier run's file keeps one header.
+# A background thread flushes every flushInterval seconds, so a lone hit doesn't wait for the next one to be written
+class OutputSink:
+    def __init__(self, path, fields, format='text', batchSize=1000, flushInterval=1.0):
+        if format not in FORMATS:
+            raise ValueError(f'Unknown output format {format!r}, expected one of {", ".join(FORMATS)}')
+        self.path = path
+        self.fields = fields
+        self.format = format
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.count = 0 # records written over the whole run
+        self.lock = threading.Lock()
+        self.pending = io.StringIO()
+        self.pendingCount = 0
+        self.lastFlush = time.monotonic()
+        self.outputFile = open(path, 'a', newline='' if format == 'csv' else None)
+        self.csvWriter = None
+        if format == 'csv':
+            self.csvWriter = csv.writer(self.pending)
+            if self.outputFile.tell() == 0:
+                csv.writer(self.outputFile).writerow(fields)
+                self.outputFile.flush()
+        self.stopEvent = threading.Event()
+        self.flusher = threading.Thread(target=self.flushPeriodically, daemon=True)
+        self.flusher.start()
+
+    def write(self, record):
+        with self.lock:
+            if self.format == 'text':
+                self.pending.write(f'{record[self.fields[0]]}\n')
+            elif self.format == 'jsonl':
+                self.pending.write(json.dumps({field: record.get(field) for field in self.fields}) + '\n')
+            else:
+                self.csvWriter.writerow([record.get(field) for field in self.fields])
+            self.count += 1
+            self.pendingCount += 1
+            if self.pendingCount >= self.batchSize or time.monotonic() - self.lastFlush >= self.flushInterval:
+                self._flush()
+
+    def flushPeriodically(self):
+        while not self.stopEvent.wait(self.flushInterval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.pendingCount:
+            self.outputFile.write(self.pending.getvalue())
+            self.outputFile.flush()
+            self.pending.seek(0)
+            self.pending.truncate()
+            self.pendingCount = 0
+        self.lastFlush = time.monotonic()
+
+    def close(self):
+        if self.outputFile.closed:
+            return
+        self.stopEvent.set()
+        self.flusher.join()
+        self.flush()
+        self.outputFile.close()
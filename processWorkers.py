@@ -0,0 +1,137 @@
+# Multi-process DNS for the processes library of both scripts
+# Each worker process generates only its own share of the candidates and resolves it on its own
+# event loop with the raw UDP engine, so only hits and stats ever cross a process boundary
+
+import asyncio
+import math
+import multiprocessing
+import os
+import queue
+import time
+
+import scanStats
+from adaptiveLimit import AdaptiveLimit
+from candidates import CandidateStats, QueryBudget, shardCandidates
+from dnsCache import DnsCache
+from resolverPool import ResolverPool
+from udpDns import UdpDnsEngine
+
+RESULT_BATCH = 500 # results per message back to the parent
+SEND_INTERVAL = 0.5 # seconds between messages even when the batch isn't full
+
+
+# Settings every worker needs, built by the parent from its command line.
+# Per-resolver limits are totals, so each of the `count` workers gets its share of them
+def workerSettings(count, concurrency, maxConcurrency, adaptive, timeout, retries, resolvers, resolverRate,
+                   resolverMaxInFlight, sockets, cachePath, cacheMaxAge, shard=None, skip=(), journal=False, maxNames=None, deadline=None):
+    return {
+        'concurrency': concurrency,
+        'maxConcurrency': maxConcurrency,
+        'adaptive': adaptive,
+        'timeout': timeout,
+        'retries': retries,
+        'resolvers': resolvers,
+        'resolverRate': resolverRate / count,
+        'resolverMaxInFlight': math.ceil(resolverMaxInFlight / count),
+        'sockets': sockets,
+        'cachePath': cachePath,
+        'cacheMaxAge': cacheMaxAge,
+        'shard': shard,
+        'skip': frozenset(skip), # names a resumed journal already finished
+        'journal': journal, # send back misses as well as hits, so the parent can journal them
+        'maxNames': None if maxNames is None else math.ceil(maxNames / count),
+        'deadline': deadline
+    }
+
+def dnsWorker(index, count, nameSource, settings, messages):
+    if os.name == 'nt': # Windows fix
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(resolveShard(index, count, nameSource, settings, messages))
+
+async def resolveShard(index, count, nameSource, settings, messages):
+    stats = scanStats.ScanStats(showProgress=False)
+    limiter = AdaptiveLimit(settings['concurrency'], settings['maxConcurrency'], adaptive=settings['adaptive'])
+    cache = DnsCache(settings['cachePath'], maxAge=settings['cacheMaxAge']) if settings['cachePath'] else None
+    pool = ResolverPool(settings['resolvers'], rate=settings['resolverRate'], maxInFlight=settings['resolverMaxInFlight'])
+    engine = UdpDnsEngine(sockets=settings['sockets'], concurrency=settings['concurrency'], timeout=settings['timeout'],
+                          retries=settings['retries'], cache=cache, stats=stats, limiter=limiter, pool=pool)
+    # The names are split between the workers as they're generated, so none of them makes the whole candidate space
+    candidateStats = CandidateStats()
+    names = nameSource(stats=candidateStats, part=(index, count))
+    if settings['shard']:
+        names = shardCandidates(names, settings['shard'])
+    skip = settings['skip']
+    counted = [0, False] # names this worker handed to the engine, and whether generation ran to the end
+    names = countNames((name for name in names if name not in skip), counted)
+    if settings['maxNames'] is not None or settings['deadline'] is not None:
+        names = QueryBudget(settings['maxNames'], settings['deadline']).limit(names)
+    results = []
+    lastSent = time.monotonic()
+    try:
+        async for name, ip in engine.resolveMany(names):
+            if ip or (ip is not None and settings['journal']):
+                results.append((name, ip))
+            if len(results) >= RESULT_BATCH or time.monotonic() - lastSent >= SEND_INTERVAL:
+                messages.put(('results', index, results))
+                messages.put(('stats', index, vars(stats.merged())))
+                results = []
+                lastSent = time.monotonic()
+    finally:
+        await engine.close()
+        if cache:
+            cache.close()
+    messages.put(('results', index, results))
+    messages.put(('stats', index, vars(stats.merged())))
+    messages.put(('finished', index, (counted[0] if counted[1] else None, vars(candidateStats))))
+
+# Passes names through, counting them in counted[0] and setting counted[1] once they run out
+def countNames(names, counted):
+    for name in names:
+        counted[0] += 1
+        yield name
+    counted[1] = True
+
+# Runs `count` worker processes over the names nameSource(stats=..., part=(index, count)) generates and calls
+# onResult(name, ip) in this process as results arrive. nameSource has to be picklable, e.g. a functools.partial.
+# Each worker's counters are mirrored into stats, so the progress line and summary cover all of them, and the names
+# they skipped are added to candidateStats. A worker that dies is reported to warn, a callable taking a message.
+# Returns how many names the workers looked up, or None if any of them stopped before running out of names
+def runWorkers(count, nameSource, settings, stats, onResult, candidateStats=None, warn=None):
+    # spawn rather than fork, since the parent already has threads running
+    context = multiprocessing.get_context('spawn')
+    messages = context.Queue()
+    workers = [context.Process(target=dnsWorker, args=(index, count, nameSource, settings, messages), daemon=True)
+               for index in range(count)]
+    counters = [stats.addCounters() for _ in workers]
+    for worker in workers:
+        worker.start()
+    running = set(range(count))
+    counts = [None] * count
+    try:
+        while running:
+            try:
+                kind, index, payload = messages.get(timeout=1)
+            except queue.Empty:
+                for index in list(running):
+                    if not workers[index].is_alive():
+                        if warn:
+                            warn(f'DNS worker process {index} exited with code {workers[index].exitcode}; its share of the names is incomplete')
+                        running.discard(index)
+                continue
+            if kind == 'results':
+                for name, ip in payload:
+                    onResult(name, ip)
+            elif kind == 'stats':
+                vars(counters[index]).update(payload)
+            elif kind == 'finished':
+                counts[index], skipped = payload
+                if candidateStats is not None:
+                    for key, value in skipped.items():
+                        setattr(candidateStats, key, getattr(candidateStats, key) + value)
+                running.discard(index)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+    return None if None in counts else sum(counts)
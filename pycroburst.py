@@ -0,0 +1,467 @@
+# Importable enumeration engine behind enumerateAzureSubDomains.py and enumerateAzureBlobs.py
+# SubdomainEnumerator and BlobEnumerator keep their resolver pool, adaptive limit, DNS engine and
+# HTTP session between calls and hand results back through async iterators, so one process can
+# scan many bases or targets without paying the setup again, e.g.
+#
+#   async with SubdomainEnumerator(words, library='udp') as enumerator:
+#       async for name, service in enumerator.enumerate(['contoso', 'fabrikam']):
+#           print(name, service)
+
+import asyncio
+import functools
+import os
+import queue
+import threading
+import time
+from concurrent import futures
+
+import scanStats
+from adaptiveLimit import AdaptiveLimit
+from asyncDns import AsyncDnsEngine
+from candidates import (subLookup, suffixDependencies, CandidateStats, subdomainCandidates, templateCandidates, dependentCandidates,
+                        DependentCount, estimateSubdomainCandidates, accountCandidates, estimateAccountCandidates, listCandidates,
+                        validFolders, streamContainerCandidates, feedQueue, inShard, shardCandidates)
+from containerProbe import ContainerProber
+from processWorkers import runWorkers, workerSettings
+from resolverPool import ResolverPool
+from udpDns import UdpDnsEngine
+
+# Patterns for joining the permutations with the base
+PATTERNS = ('{word}-{base}','{base}-{word}','{word}{base}','{base}{word}')
+LIBRARIES = ('none','threading','futures','asyncio','udp','processes')
+ASYNC_LIBRARIES = ('asyncio','udp','processes')
+
+# Kinds of result BlobEnumerator.enumerate yields, as (kind, name, url) tuples
+ACCOUNT = 'account' # a storage account resolved; url is None
+BLOB = 'blob' # a public blob, or an empty public container when url is None
+RESOLVED = 'resolved' # DNS is finished, so no more accounts will come; name and url are None
+
+DONE = object() # marks the end of a stage in the shared results queue
+
+
+# The service a found name belongs to, e.g. 'Storage Accounts - Blobs'
+def serviceOf(name):
+    return subLookup['.'.join(name.split('.')[1:])]
+
+# Bases are walked more than once (counting, scanning, pruning), so a one-shot iterator is read into a list
+def reusable(bases):
+    return list(bases) if iter(bases) is bases else bases
+
+
+# DNS side shared by both enumerators: one resolver pool, adaptive limit and stats for every call,
+# and one async engine per event loop. `library` picks how names are resolved:
+# none, threading and futures use blocking lookups on threads, asyncio and udp run on the event loop,
+# and processes spreads the names over worker processes.
+# `cache` (dnsCache.DnsCache) and `journal` (scanJournal.ScanJournal) are optional and stay owned by the caller.
+# `pool` and `limiter` let two enumerators share one resolver pool and one adaptive limit.
+# `budget` (candidates.QueryBudget) stops every call once its query count or deadline is used up.
+# `warn` is called with a message for problems the scan carries on past, like a worker process dying
+class DnsEnumerator:
+    def __init__(self, library='udp', concurrency=1000, threads=10, maxConcurrency=None, adaptive=True, timeout=2.0, retries=2,
+                 resolvers=None, resolverRate=0, resolverMaxInFlight=0, sockets=4, processes=None, cache=None, journal=None,
+                 stats=None, shard=None, pool=None, limiter=None, budget=None, warn=None):
+        if library not in LIBRARIES:
+            raise ValueError(f'Unknown library {library!r}, expected one of {", ".join(LIBRARIES)}')
+        self.library = library
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.resolverRate = resolverRate
+        self.resolverMaxInFlight = resolverMaxInFlight
+        self.sockets = sockets
+        self.processes = max(1, processes or os.cpu_count() or 1)
+        self.cache = cache
+        self.journal = journal
+        self.history = None
+        self.budget = budget
+        self.shard = shard
+        self.warn = warn
+        self.pool = pool or ResolverPool(resolvers, rate=resolverRate, maxInFlight=resolverMaxInFlight)
+        self.stats = stats or scanStats.ScanStats(showProgress=False)
+        # concurrency or threads is where the limit starts; it grows while things are healthy and backs off on timeouts and SERVFAILs
+        initial = concurrency if library in ASYNC_LIBRARIES else threads
+        self.limiter = limiter or AdaptiveLimit(initial, maxConcurrency or initial*8, adaptive=adaptive)
+        # Worker processes each adapt their own limit
+        self.stats.limiter = self.limiter if library != 'processes' else None
+        self.candidateStats = CandidateStats()
+        self.engine = None
+        self.engineLoop = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.engine is not None and self.engineLoop is asyncio.get_running_loop():
+            await self.engine.close()
+        self.engine = None
+
+    # Sockets belong to the loop they were opened on, so a call from a new loop gets a new engine
+    def dnsEngine(self):
+        loop = asyncio.get_running_loop()
+        if self.engine is None or self.engineLoop is not loop:
+            if self.library == 'udp':
+                self.engine = UdpDnsEngine(sockets=self.sockets, concurrency=self.concurrency, timeout=self.timeout, retries=self.retries,
+                                           cache=self.cache, stats=self.stats, limiter=self.limiter, pool=self.pool)
+            else:
+                self.engine = AsyncDnsEngine(concurrency=self.concurrency, timeout=self.timeout, retries=self.retries,
+                                             cache=self.cache, stats=self.stats, limiter=self.limiter, pool=self.pool)
+            self.engineLoop = loop
+        return self.engine
+
+    # Names outside the shard, or already finished according to the journal, are skipped
+    def pending(self, names):
+        if self.shard:
+            names = shardCandidates(names, self.shard)
+        if self.journal:
+            names = self.journal.unfinished(names)
+        return names
+
+    # Adds estimate to the progress total as names start going out, then settles it to the exact count once they run out,
+    # so nothing has to walk the candidates before the first query
+    def tally(self, names, estimate):
+        self.stats.total += estimate
+        count = 0
+        for name in names:
+            count += 1
+            yield name
+        self.stats.total += count - estimate
+
+    # This node's share of an estimate for the whole candidate space
+    def shardEstimate(self, estimate):
+        return estimate // self.shard[1] if self.shard else estimate
+
+    # Every definitive answer, '' for a name that doesn't exist, goes to the journal and the hit history
+    def recordResult(self, name, ip):
+        if self.journal:
+            self.journal.record(name, ip)
+        if self.history:
+            self.history.record(name, ip)
+
+    # Feeds one query attempt to the stats and the adaptive concurrency limit
+    def recordQuery(self, outcome, started):
+        # A timeout has no reply time, and an error is too quick to say anything about the resolver
+        latency = time.perf_counter() - started if outcome not in (scanStats.TIMEOUT, scanStats.ERROR) else None
+        self.stats.query(outcome, latency)
+        self.limiter.record(outcome in (scanStats.TIMEOUT, scanStats.SERVFAIL, scanStats.ERROR), latency)
+
+    # Blocking lookup for the threaded libraries: returns the IP if the name exists, '' if not.
+    # An answer that comes back after stopped is set has nobody left to pass a hit to, so it isn't journaled
+    # either and a resumed run asks again
+    def resolveName(self, name, stopped=None):
+        if self.cache:
+            cached = self.cache.get(name)
+            if cached is not None:
+                self.stats.done(bool(cached), cached=True)
+                self.recordResult(name, cached)
+                return cached
+        # Each attempt goes to an upstream picked by the resolver pool; retries go to a different one
+        tried = set()
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            ip, outcome, upstream = self.pool.query(name, self.timeout, exclude=tried)
+            self.recordQuery(outcome, started)
+            if outcome not in (scanStats.TIMEOUT, scanStats.SERVFAIL, scanStats.ERROR):
+                break
+            tried.add(upstream)
+        if ip is None:
+            # timeouts and server failures aren't cached
+            self.stats.done(False)
+            return ''
+        if self.cache:
+            self.cache.put(name, ip)
+        self.stats.done(bool(ip))
+        if stopped is not None and stopped.is_set():
+            return ''
+        self.recordResult(name, ip)
+        return ip
+
+    def workerSettings(self):
+        return workerSettings(self.processes, self.concurrency, self.limiter.maximum, self.limiter.adaptive, self.timeout, self.retries,
+                              [f'[{upstream.host}]:{upstream.port}' for upstream in self.pool.upstreams], self.resolverRate,
+                              self.resolverMaxInFlight, self.sockets, self.cache.path if self.cache else None,
+                              self.cache.maxAge if self.cache else 0, self.shard,
+                              self.journal.finished if self.journal else (), self.journal is not None or self.history is not None,
+                              self.budget.remaining() if self.budget else None, self.budget.deadline if self.budget else None)
+
+    # Runs a blocking library over names on this thread, calling found(name) for every hit.
+    # The processes library makes its own names from nameSource, so it settles the progress total from estimate itself.
+    # Setting stopped (a threading.Event) ends the threaded libraries once the lookups already out come back
+    def resolveBlocking(self, names, nameSource, found, estimate, stopped):
+        if self.library == 'processes':
+            # Results arrive in batches; misses only come back when they need journaling or go in the hit history
+            def onResult(name, ip):
+                self.recordResult(name, ip)
+                if ip:
+                    found(name)
+            # The workers apply their share of the budget themselves, so it's settled from the stats afterwards
+            done = self.stats.merged().done
+            self.stats.total += estimate
+            count = runWorkers(self.processes, nameSource, self.workerSettings(), self.stats, onResult, self.candidateStats, self.warn)
+            if count is not None:
+                self.stats.total += count - estimate
+            if self.budget:
+                self.budget.used += self.stats.merged().done - done
+                self.budget.check()
+            return
+        if self.library == 'none':
+            if self.budget:
+                names = self.budget.limit(names)
+            for name in names:
+                if stopped.is_set():
+                    return
+                if self.resolveName(name, stopped):
+                    found(name)
+            return
+
+        # There are enough threads for the highest limit; the limiter decides how many are querying at once.
+        # The queue runs far ahead of the lookups, so the budget is taken as names come off it.
+        # Once stopped, the names still queued are only taken off so the feeder can get the Nones in
+        def drain(workQueue):
+            while True:
+                name = workQueue.get()
+                if name is None:
+                    return
+                if stopped.is_set() or (self.budget and not self.budget.take()):
+                    continue
+                with self.limiter:
+                    ip = self.resolveName(name, stopped)
+                if ip:
+                    found(name)
+
+        workQueue = queue.Queue(maxsize=self.limiter.maximum*100)
+        feedQueue(self.budget.until(names) if self.budget else names, workQueue, self.limiter.maximum, stopped)
+        if self.library == 'futures':
+            with futures.ThreadPoolExecutor(max_workers=self.limiter.maximum) as executor:
+                for future in [executor.submit(drain, workQueue) for _ in range(self.limiter.maximum)]:
+                    future.result()
+        else:
+            threads = [threading.Thread(target=drain, args=(workQueue,)) for _ in range(self.limiter.maximum)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    # Resolves the names nameSource makes, yielding the ones that exist as they are found. nameSource is a picklable
+    # callable taking a CandidateStats and a part, so each worker of the processes library can make its share of the names.
+    # estimate is roughly how many names it makes, for the progress total until the exact count is known.
+    # share (adaptiveLimit.JobShare) only applies to asyncio and udp, where calls share one engine.
+    # Names left when the budget runs out are never looked up
+    async def resolveNames(self, nameSource, estimate, share=None):
+        names = None
+        if self.library != 'processes':
+            names = self.tally(self.pending(nameSource(stats=self.candidateStats)), estimate)
+        if self.library in ('asyncio','udp'):
+            if self.budget:
+                names = self.budget.limit(names)
+            async for name, ip in self.dnsEngine().resolveMany(names, share):
+                if ip is not None:
+                    self.recordResult(name, ip)
+                if ip:
+                    yield name
+            return
+
+        # Blocking libraries run on a worker thread and pass hits back to the loop.
+        # Cancelling the scan, e.g. with Ctrl-C, stops their threads too rather than leaving them to run through every name
+        loop = asyncio.get_running_loop()
+        hits = asyncio.Queue()
+        stopped = threading.Event()
+        runner = loop.run_in_executor(None, self.resolveBlocking, names, nameSource,
+                                      lambda name: loop.call_soon_threadsafe(hits.put_nowait, name), estimate, stopped)
+        runner.add_done_callback(lambda _: hits.put_nowait(DONE))
+        try:
+            while True:
+                name = await hits.get()
+                if name is DONE:
+                    break
+                yield name
+            await runner # re-raises anything the lookups raised
+        finally:
+            stopped.set()
+
+
+# Finds Azure subdomains for bases joined with permutation words, yielding (name, service) pairs.
+# With prune on, dependent suffixes (file/queue/table, scm) are only queried for labels whose root suffix resolved.
+# With a `history` (hitHistory.HitHistory), every answer is added to it and the names are tried likeliest first
+class SubdomainEnumerator(DnsEnumerator):
+    def __init__(self, words, patterns=PATTERNS, prune=True, history=None, **options):
+        super().__init__(**options)
+        self.words = [word.strip() for word in words]
+        self.patterns = patterns
+        self.prune = prune
+        self.history = history
+        if history:
+            history.learn(patterns, self.words)
+        self.rootSuffixes, self.dependentSuffixes = self.suffixes()
+        self.dependentNames = 0 # names the dependent passes queried
+
+    # Queries skipped because the name they depend on didn't resolve
+    @property
+    def pruned(self):
+        return self.candidateStats.dependable - self.dependentNames
+
+    # (root, dependent) suffixes for the chosen services, given as suffixes or service names, or for all of them.
+    # A dependent suffix whose root isn't chosen is queried like a root
+    def suffixes(self, services=None):
+        chosen = [domain for domain in subLookup if services is None or domain in services or subLookup[domain] in services]
+        if not self.prune:
+            return chosen, []
+        dependent = [domain for domain in chosen if suffixDependencies.get(domain) in chosen]
+        return [domain for domain in chosen if domain not in dependent], dependent
+
+    # Picklable maker of the first pass's names: ranked by the hit history when there is one, else base by base in file order
+    def nameSource(self, bases, suffixes, words):
+        if self.history:
+            return functools.partial(templateCandidates, bases, self.history.rank(self.patterns, words, suffixes))
+        return functools.partial(subdomainCandidates, bases, suffixes, self.patterns, words)
+
+    # words and services replace the enumerator's own for this call only
+    async def enumerate(self, bases, words=None, services=None, share=None):
+        bases = reusable(bases)
+        words = self.words if words is None else [word.strip() for word in words]
+        rootSuffixes, dependentSuffixes = (self.rootSuffixes, self.dependentSuffixes) if services is None else self.suffixes(services)
+        if self.history and words is not self.words:
+            self.history.learn(self.patterns, words)
+        nameSource = self.nameSource(bases, rootSuffixes, words)
+        if dependentSuffixes:
+            nameSource = DependentCount(nameSource, dependentSuffixes, self.shard)
+        estimate = self.shardEstimate(estimateSubdomainCandidates(bases, rootSuffixes, self.patterns, words))
+        hits = []
+        async for name in self.resolveNames(nameSource, estimate, share):
+            hits.append(name)
+            yield name, serviceOf(name)
+        if not dependentSuffixes:
+            return
+
+        if self.journal:
+            hits += [hit for hit, _ in self.journal.hits]
+        dependentNames = [name for name in dependentCandidates(hits) if name.split('.', 1)[1] in dependentSuffixes]
+        self.dependentNames += len(dependentNames)
+        async for name in self.resolveNames(functools.partial(listCandidates, dependentNames), len(dependentNames), share):
+            yield name, serviceOf(name)
+
+
+# Finds storage accounts for bases joined with permutation words, and public containers and blobs
+# in them, yielding (kind, name, url) tuples. Accounts go to container probing as DNS confirms them,
+# so both stages run at once. The HTTP session and the accounts ruled out for anonymous access, for a day,
+# carry over from one call to the next; the accounts each call finds are its own. With a `state`
+# (containerState.ContainerState), every public container listed is recorded in it, and rescan() re-checks the recorded ones
+class BlobEnumerator(DnsEnumerator):
+    def __init__(self, words, folders, httpConcurrency=200, perAccount=16, httpTimeout=15.0, blobEndpoint=None, state=None, **options):
+        super().__init__(**options)
+        self.words = [word.strip() for word in words]
+        self.folders = validFolders(folders, self.candidateStats)
+        self.domain = '.blob.core.windows.net'
+        self.prober = ContainerProber(concurrency=httpConcurrency, perAccount=perAccount, timeout=httpTimeout, endpoint=blobEndpoint)
+        self.prober.journal = self.journal
+        self.prober.state = state
+
+    async def close(self):
+        await super().close()
+        await self.prober.close()
+
+    # accounts are extra storage account hosts to probe, like Bing results, and folders extra container names to guess.
+    # discovered is an async iterable of (account host, container) pairs, e.g. from bingSearch.BingSearch.discover,
+    # probed as they arrive: the container first on its own account, then the usual folders for a new account.
+    # words replace the enumerator's own for this call only
+    async def enumerate(self, bases, accounts=(), folders=(), words=None, share=None, discovered=None):
+        bases = reusable(bases)
+        words = self.words if words is None else [word.strip() for word in words]
+        folderList = validFolders(list(folders) + self.folders) if folders else self.folders
+        # Bounded, so DNS waits rather than queueing accounts faster than they can be probed
+        accountQueue = asyncio.Queue(maxsize=1000)
+        results = asyncio.Queue(maxsize=1000)
+        seenAccounts = set()
+
+        # Queues a confirmed account's folder guesses for probing, once per account
+        async def addAccount(name, accountFolders=None):
+            name = name.lower()
+            if name in seenAccounts:
+                self.candidateStats.duplicates += len(folderList)
+                return
+            seenAccounts.add(name)
+            await results.put((ACCOUNT, name, None))
+            await accountQueue.put((name, accountFolders) if accountFolders else name)
+
+        async def discoverStage():
+            folderSet = set(folderList)
+            probed = set()
+            async for name, container in discovered:
+                name = name.lower()
+                if self.shard and not inShard(name, self.shard):
+                    continue
+                extra = [folderName for folderName in validFolders([container]) if (name, folderName) not in probed]
+                probed.update((name, folderName) for folderName in extra)
+                if name not in seenAccounts:
+                    await addAccount(name, extra + [folderName for folderName in folderList if folderName not in extra])
+                elif extra and extra[0] not in folderSet:
+                    await accountQueue.put((name, extra))
+
+        # Finishes by closing the account queue with a None, once DNS and any discovery are both done
+        async def resolveStage():
+            discovery = asyncio.ensure_future(discoverStage()) if discovered is not None else None
+            try:
+                for name in accounts:
+                    # Accounts from elsewhere are the same on every node, so each one only probes the accounts in its shard
+                    if not self.shard or inShard(name.lower(), self.shard):
+                        await addAccount(name)
+                if self.journal:
+                    # Accounts found before the interruption still have folders left to check
+                    for name, _ in self.journal.hits:
+                        await addAccount(name)
+                nameSource = functools.partial(accountCandidates, bases, words, self.domain)
+                async for name in self.resolveNames(nameSource, self.shardEstimate(estimateAccountCandidates(bases, words)), share):
+                    await addAccount(name)
+                if discovery:
+                    await discovery
+                await results.put((RESOLVED, None, None))
+            finally:
+                if discovery:
+                    discovery.cancel()
+                # Once the consumer has gone there is nobody left to tell, and the queues may be full
+                if not closing:
+                    await accountQueue.put(None)
+                    await results.put(DONE)
+
+        async def probeStage():
+            try:
+                guesses = streamContainerCandidates(accountQueue, folderList, self.prober.deadAccounts)
+                if self.journal:
+                    guesses = self.journal.unfinishedAsync(guesses)
+                async for dirGuess, blobUrl in self.prober.probeMany(guesses):
+                    await results.put((BLOB, dirGuess, blobUrl))
+            finally:
+                if not closing:
+                    await results.put(DONE)
+
+        closing = False
+        stages = [asyncio.ensure_future(resolveStage()), asyncio.ensure_future(probeStage())]
+        try:
+            running = len(stages)
+            while running:
+                result = await results.get()
+                if result is not DONE:
+                    yield result
+                    continue
+                running -= 1
+                # A stage that failed can leave the other one waiting on it forever, so its error ends the scan
+                for stage in stages:
+                    if stage.done() and not stage.cancelled() and stage.exception():
+                        await stage
+        finally:
+            closing = True
+            for stage in stages:
+                stage.cancel()
+
+    # Re-checks containers in the state store, all of them by default, without any DNS or guessing.
+    # Yields (kind, dirGuess, url) with kind ADDED or REMOVED for each blob that changed,
+    # UNCHANGED once for a container that didn't, GONE for one that can't be listed anymore
+    # and FAILED for one that couldn't be listed this time
+    async def rescan(self, containers=None):
+        if self.prober.state is None:
+            raise ValueError('rescan needs a state store')
+        containers = self.prober.state.known() if containers is None else containers
+        async for change in self.prober.probeMany(containers, probe=self.prober.rescan, skipDead=False):
+            yield change
@@ -0,0 +1,168 @@
+# Spreads DNS queries across several upstream resolvers
+# Each upstream gets its own token-bucket rate limit, in-flight cap and health score;
+# upstreams that keep timing out or failing are drained for a while, and retries go to a different upstream
+
+import asyncio
+import os
+import threading
+import time
+
+import dns.exception
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdatatype
+import dns.resolver
+import dns.asyncquery
+
+import scanStats
+
+
+class Upstream:
+    def __init__(self, host, port=53, rate=0, maxInFlight=0):
+        self.host = host
+        self.port = port
+        self.rate = rate # queries per second, 0 for unlimited
+        self.tokens = float(rate)
+        self.lastRefill = time.monotonic()
+        self.maxInFlight = maxInFlight # 0 for unlimited
+        self.inFlight = 0
+        self.score = 1.0 # moving average of successful replies
+        self.drainedUntil = 0.0
+
+    def __repr__(self):
+        return f'{self.host}:{self.port}'
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(float(self.rate), self.tokens + (now - self.lastRefill) * self.rate)
+            self.lastRefill = now
+
+    # Seconds until this upstream can take another query, 0 if it can right now
+    def wait(self, now):
+        if self.maxInFlight and self.inFlight >= self.maxInFlight:
+            return 0.005
+        if self.rate and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0.0
+
+
+# 'host', 'host:port' or '[v6 address]:port'
+def parseUpstream(spec):
+    spec = spec.strip()
+    if spec.startswith('['):
+        host, _, port = spec[1:].partition(']')
+        return host, int(port.lstrip(':') or 53)
+    if spec.count(':') == 1:
+        host, port = spec.split(':')
+        return host, int(port)
+    return spec, 53
+
+# --resolvers takes a comma separated list or a file with one resolver per line
+def readResolverSpecs(value):
+    if os.path.isfile(value):
+        with open(value) as resolverFile:
+            return [line.strip() for line in resolverFile if line.strip() and not line.startswith('#')]
+    return [spec for spec in value.split(',') if spec.strip()]
+
+# returns (ip, outcome) for a parsed reply: ip is '' for NXDOMAIN/NODATA and None for server failures
+def parseMessage(response):
+    rcode = response.rcode()
+    if rcode in (dns.rcode.SERVFAIL, dns.rcode.REFUSED):
+        return None, scanStats.SERVFAIL
+    if rcode != dns.rcode.NOERROR:
+        return '', scanStats.NXDOMAIN
+    # Azure names are CNAME chains, so take the first A record anywhere in the answer
+    for rrset in response.answer:
+        if rrset.rdtype == dns.rdatatype.A:
+            for rdata in rrset:
+                return rdata.address, scanStats.NOERROR
+    return '', scanStats.NXDOMAIN
+
+
+class ResolverPool:
+    def __init__(self, specs=None, rate=0, maxInFlight=0, drainTime=10.0, drainScore=0.3):
+        if not specs:
+            specs = dns.resolver.Resolver().nameservers
+        self.upstreams = [Upstream(host, port, rate, maxInFlight) for host, port in map(parseUpstream, specs)]
+        self.drainTime = drainTime
+        self.drainScore = drainScore
+        self.lock = threading.Lock()
+
+    # Picks the least loaded healthy upstream that has room, or returns the seconds to wait before trying again
+    def pick(self, exclude=()):
+        now = time.monotonic()
+        with self.lock:
+            candidates = [upstream for upstream in self.upstreams if upstream not in exclude and upstream.drainedUntil <= now]
+            if not candidates:
+                # Everything is drained or already tried, so fall back to whatever is least bad rather than stall
+                candidates = [upstream for upstream in self.upstreams if upstream not in exclude] or self.upstreams
+            waits = []
+            for upstream in candidates:
+                upstream.refill(now)
+                waits.append(upstream.wait(now))
+            ready = [upstream for upstream, wait in zip(candidates, waits) if wait == 0]
+            if not ready:
+                return None, min(waits)
+            upstream = min(ready, key=lambda upstream: (upstream.inFlight + 1) / max(upstream.score, 0.05))
+            upstream.inFlight += 1
+            if upstream.rate:
+                upstream.tokens -= 1
+            return upstream, 0
+
+    def acquire(self, exclude=()):
+        while True:
+            upstream, wait = self.pick(exclude)
+            if upstream:
+                return upstream
+            time.sleep(wait)
+
+    async def acquireAsync(self, exclude=()):
+        while True:
+            upstream, wait = self.pick(exclude)
+            if upstream:
+                return upstream
+            await asyncio.sleep(wait)
+
+    # Hands the upstream back along with how the query went, updating its health
+    def release(self, upstream, outcome):
+        failed = outcome in (scanStats.TIMEOUT, scanStats.SERVFAIL, scanStats.ERROR)
+        with self.lock:
+            upstream.inFlight -= 1
+            upstream.score = upstream.score * 0.95 + (0.0 if failed else 0.05)
+            if upstream.score < self.drainScore:
+                upstream.drainedUntil = time.monotonic() + self.drainTime
+                upstream.score = 0.5 # back on probation once the drain ends
+
+    # One blocking A query to one upstream for the threaded modes: returns (ip, outcome, upstream)
+    def query(self, name, timeout, exclude=()):
+        upstream = self.acquire(exclude)
+        outcome = scanStats.ERROR
+        try:
+            response = dns.query.udp(dns.message.make_query(name, dns.rdatatype.A), upstream.host,
+                                     timeout=timeout, port=upstream.port)
+            ip, outcome = parseMessage(response)
+            return ip, outcome, upstream
+        except dns.exception.Timeout:
+            outcome = scanStats.TIMEOUT
+            return None, outcome, upstream
+        except Exception:
+            return None, outcome, upstream
+        finally:
+            self.release(upstream, outcome)
+
+    async def queryAsync(self, name, timeout, exclude=()):
+        upstream = await self.acquireAsync(exclude)
+        outcome = scanStats.ERROR
+        try:
+            response = await dns.asyncquery.udp(dns.message.make_query(name, dns.rdatatype.A), upstream.host,
+                                                timeout=timeout, port=upstream.port)
+            ip, outcome = parseMessage(response)
+            return ip, outcome, upstream
+        except dns.exception.Timeout:
+            outcome = scanStats.TIMEOUT
+            return None, outcome, upstream
+        except Exception:
+            return None, outcome, upstream
+        finally:
+            self.release(upstream, outcome)
@@ -0,0 +1,106 @@
+# Append-only checkpoint journal for long enumeration runs
+# Every finished candidate and every hit is written as one JSON line, in batches,
+# so an interrupted run can be resumed by skipping what the journal already has
+
+import json
+import threading
+import time
+
+
+class ScanJournal:
+    def __init__(self, path, resume=False, batchSize=1000, flushInterval=2.0):
+        self.path = path
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.finished = set() # names and container guesses completed by earlier runs
+        self.hits = [] # (name, ip) pairs found by earlier runs, in the order they were found
+        self.found = [] # (container guess, blob URL or None if empty) pairs found by earlier runs
+        self.partial = set() # the same pairs from listings that were cut off, which are probed again
+        self.skipped = 0
+        if resume:
+            self.load()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.lastFlush = time.monotonic()
+        self.journalFile = open(path, 'a')
+
+    def load(self):
+        try:
+            journalFile = open(self.path)
+        except FileNotFoundError:
+            return
+        with journalFile:
+            for line in journalFile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # a line cut short by a crash
+                if 'hit' in entry:
+                    self.finished.add(entry['hit'])
+                    self.hits.append((entry['hit'], entry['ip']))
+                elif 'done' in entry:
+                    self.finished.add(entry['done'])
+                elif 'found' in entry:
+                    self.found.append((entry['found'], entry['url']))
+        # A listing cut off part way is probed again from the start, so only complete ones are replayed,
+        # without the repeats the earlier partial attempt left behind
+        found = dict.fromkeys(self.found)
+        self.found = [(dirGuess, blobUrl) for dirGuess, blobUrl in found if dirGuess in self.finished]
+        self.partial = {(dirGuess, blobUrl) for dirGuess, blobUrl in found if dirGuess not in self.finished}
+
+    def write(self, entry):
+        with self.lock:
+            self.pending.append(json.dumps(entry) + '\n')
+            if len(self.pending) >= self.batchSize or time.monotonic() - self.lastFlush >= self.flushInterval:
+                self._flush()
+
+    # A name with a definitive answer: ip is '' when it doesn't exist
+    def record(self, name, ip):
+        if ip:
+            self.write({'hit': name, 'ip': ip})
+        else:
+            self.write({'done': name})
+
+    # Part of a public container's listing; the guess itself is recorded once the whole listing is in
+    def recordFound(self, dirGuess, blobUrl):
+        self.write({'found': dirGuess, 'url': blobUrl})
+
+    # Whether an earlier run already found this result in a listing that was cut off, and so already put it out
+    def foundBefore(self, dirGuess, blobUrl):
+        return (dirGuess, blobUrl) in self.partial
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.journalFile.writelines(self.pending)
+            self.journalFile.flush()
+            self.pending = []
+        self.lastFlush = time.monotonic()
+
+    def close(self):
+        if self.journalFile.closed:
+            return
+        self.flush()
+        self.journalFile.close()
+
+    # Filters out names an earlier run already finished
+    def unfinished(self, names):
+        for name in names:
+            if name in self.finished:
+                self.skipped += 1
+            else:
+                yield name
+
+    async def unfinishedAsync(self, names):
+        async for name in names:
+            if name in self.finished:
+                self.skipped += 1
+            else:
+                yield name
+
+    def report(self):
+        return (f'Resumed from {self.path}: {len(self.hits)} earlier hits, '
+                f'{len(self.found)} earlier results, {self.skipped} finished names skipped')
@@ -0,0 +1,208 @@
+# Low-overhead scan statistics and progress display
+# Workers bump plain counters that belong to their own thread; a reporter thread
+# merges them on an interval, redraws the progress line and keeps a time series
+
+import json
+import shutil
+import sys
+import threading
+import time
+
+# Outcomes of a single DNS query attempt
+NOERROR = 'noerror'
+NXDOMAIN = 'nxdomain'
+TIMEOUT = 'timeout'
+SERVFAIL = 'servfail'
+ERROR = 'error'
+OUTCOMES = (NOERROR, NXDOMAIN, TIMEOUT, SERVFAIL, ERROR)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))
+
+
+class WorkerCounters:
+    def __init__(self):
+        self.done = 0 # candidate names finished, whether answered from cache or the network
+        self.hits = 0
+        self.cached = 0
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.latency = [0] * len(LATENCY_BUCKETS)
+
+
+# Estimates a percentile from histogram bucket counts, reporting the bucket's upper bound
+def histogramPercentile(latency, fraction):
+    total = sum(latency)
+    if not total:
+        return None
+    running = 0
+    for bound, count in zip(LATENCY_BUCKETS, latency):
+        running += count
+        if running >= total * fraction:
+            return bound if bound != float('inf') else LATENCY_BUCKETS[-2]
+    return LATENCY_BUCKETS[-2]
+
+
+# None when nothing went out on the network, e.g. a run answered from the cache
+def formatLatency(latency):
+    return 'n/a' if latency is None else f'{latency}s'
+
+
+class ScanStats:
+    def __init__(self, total=0, interval=0.5, showProgress=True, statsPath=None):
+        self.total = total
+        self.interval = interval
+        self.showProgress = showProgress
+        self.statsPath = statsPath
+        self.local = threading.local()
+        self.workers = []
+        self.registerLock = threading.Lock()
+        self.samples = [] # only kept when there is a --stats-json file to write them to
+        self.lastSample = None
+        self.startTime = time.time()
+        self.stopEvent = threading.Event()
+        self.reporter = None
+        self.limiter = None # optional adaptiveLimit.AdaptiveLimit whose current limit is sampled too
+
+    # The calling thread's own counters, registered on first use
+    def counters(self):
+        counters = getattr(self.local, 'counters', None)
+        if counters is None:
+            counters = WorkerCounters()
+            self.local.counters = counters
+            with self.registerLock:
+                self.workers.append(counters)
+        return counters
+
+    # Counters filled in from somewhere else, like a worker process, and merged with the rest
+    def addCounters(self):
+        counters = WorkerCounters()
+        with self.registerLock:
+            self.workers.append(counters)
+        return counters
+
+    # One query attempt on the network
+    def query(self, outcome, latency=None):
+        counters = self.counters()
+        counters.outcomes[outcome] += 1
+        if latency is not None:
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    counters.latency[index] += 1
+                    break
+
+    # One candidate name finished
+    def done(self, hit, cached=False):
+        counters = self.counters()
+        counters.done += 1
+        if hit:
+            counters.hits += 1
+        if cached:
+            counters.cached += 1
+
+    def merged(self):
+        merged = WorkerCounters()
+        with self.registerLock:
+            workers = list(self.workers)
+        for counters in workers:
+            merged.done += counters.done
+            merged.hits += counters.hits
+            merged.cached += counters.cached
+            for outcome in OUTCOMES:
+                merged.outcomes[outcome] += counters.outcomes[outcome]
+            for index in range(len(LATENCY_BUCKETS)):
+                merged.latency[index] += counters.latency[index]
+        return merged
+
+    def sample(self):
+        merged = self.merged()
+        now = time.time()
+        previous = self.lastSample
+        elapsed = (now - self.startTime) - (previous['elapsed'] if previous else 0)
+        queries = sum(merged.outcomes.values())
+        intervalLatency = merged.latency
+        if previous:
+            intervalLatency = [count - before for count, before in zip(merged.latency, previous['latencyHistogram'])]
+        sample = {
+            'elapsed': round(now - self.startTime, 3),
+            'done': merged.done,
+            'total': self.total,
+            'hits': merged.hits,
+            'cached': merged.cached,
+            'queries': queries,
+            'namesPerSecond': round((merged.done - (previous['done'] if previous else 0)) / elapsed, 1) if elapsed > 0 else 0,
+            'queriesPerSecond': round((queries - (previous['queries'] if previous else 0)) / elapsed, 1) if elapsed > 0 else 0,
+            'latencyP50': histogramPercentile(intervalLatency, 0.5),
+            'latencyP90': histogramPercentile(intervalLatency, 0.9),
+            'latencyP99': histogramPercentile(intervalLatency, 0.99),
+            'latencyHistogram': merged.latency,
+            'concurrency': self.limiter.current() if self.limiter else None
+        }
+        sample.update(merged.outcomes)
+        self.lastSample = sample
+        if self.statsPath:
+            self.samples.append(sample)
+        return sample
+
+    def display(self, sample):
+        width = shutil.get_terminal_size().columns
+        status = (f' {sample["done"]}/{sample["total"]} {sample["namesPerSecond"]:.0f}/s '
+                  f'hits:{sample["hits"]} timeouts:{sample[TIMEOUT]} servfail:{sample[SERVFAIL]}')
+        if sample['concurrency']:
+            status += f' limit:{sample["concurrency"]}'
+        barWidth = max(0, width - len(status) - 3)
+        filled = int(barWidth * sample['done'] / sample['total']) if sample['total'] else 0
+        sys.stdout.write(f'\r[{"o" * filled}{" " * (barWidth - filled)}]{status}'[:width])
+        sys.stdout.flush()
+
+    def report(self):
+        while not self.stopEvent.wait(self.interval):
+            sample = self.sample()
+            if self.showProgress:
+                self.display(sample)
+
+    def start(self):
+        self.stopEvent.clear()
+        self.reporter = threading.Thread(target=self.report, daemon=True)
+        self.reporter.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.reporter:
+            self.reporter.join()
+            self.reporter = None
+        sample = self.sample()
+        if self.showProgress:
+            self.display(sample)
+            sys.stdout.write('\r' + ' ' * shutil.get_terminal_size().columns + '\r')
+            sys.stdout.flush()
+        return sample
+
+    def summary(self):
+        merged = self.merged()
+        elapsed = time.time() - self.startTime
+        return (f'{merged.done} names in {elapsed:.1f}s ({merged.done / elapsed if elapsed else 0:.0f}/s), '
+                f'{sum(merged.outcomes.values())} queries, {merged.cached} from cache, '
+                f'{merged.outcomes[NXDOMAIN]} NXDOMAIN, {merged.outcomes[TIMEOUT]} timeouts, '
+                f'{merged.outcomes[SERVFAIL]} SERVFAIL, {merged.outcomes[ERROR]} errors, p50 latency {formatLatency(histogramPercentile(merged.latency, 0.5))}')
+
+    def writeJson(self):
+        if not self.statsPath:
+            return
+        merged = self.merged()
+        with open(self.statsPath, 'w') as statsFile:
+            json.dump({
+                'started': self.startTime,
+                'latencyBuckets': [bound if bound != float('inf') else None for bound in LATENCY_BUCKETS],
+                'summary': {
+                    'done': merged.done,
+                    'hits': merged.hits,
+                    'cached': merged.cached,
+                    'queries': sum(merged.outcomes.values()),
+                    'outcomes': merged.outcomes,
+                    'latencyHistogram': merged.latency,
+                    'latencyP50': histogramPercentile(merged.latency, 0.5),
+                    'latencyP90': histogramPercentile(merged.latency, 0.9),
+                    'latencyP99': histogramPercentile(merged.latency, 0.99)
+                },
+                'samples': self.samples
+            }, statsFile, indent=1)
@@ -0,0 +1,77 @@
+# Checks that ranked candidate generation makes the same names as the plain base-by-base one
+# Run with `python -m pytest` or `python -m unittest discover tests` from the repo root
+
+import collections
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from candidates import CandidateStats, subLookup, subdomainCandidates, templateCandidates
+from hitHistory import HitHistory
+from pycroburst import PATTERNS
+
+# Words that spell the same label as another word or pattern: repeats, case variants, an empty word,
+# a base used as a word and words that carry the pattern's own hyphen
+WORDS = ['dev', 'DEV', 'prod', '', 'x_y', 'corp', '-x', 'x-', 'a' * 70, 'dev', 'backup']
+BASES = ['corp', 'Corp', 'corpdev', 'dev', 'a-b', 'x', 'corp']
+SUFFIXES = list(subLookup)
+
+
+def skewedHistory():
+    history = HitHistory(':memory:')
+    rng = random.Random(3)
+    history.counts[('all', '')] = [10000, 300]
+    for word in WORDS:
+        history.counts[('word', word.lower())] = [rng.randint(0, 200), rng.randint(0, 20)]
+    for pattern in PATTERNS:
+        history.counts[('pattern', pattern)] = [rng.randint(100, 900), rng.randint(0, 60)]
+    for domain in SUFFIXES[::2]:
+        history.counts[('suffix', domain)] = [rng.randint(100, 900), rng.randint(0, 60)]
+    return history
+
+def generate(make, parts=1):
+    names, stats = [], CandidateStats()
+    for index in range(parts):
+        names += make(stats=stats, part=(index, parts))
+    return names, vars(stats)
+
+
+class TemplateCandidatesTest(unittest.TestCase):
+    def assertSameAsSubdomainCandidates(self, history):
+        expected, expectedStats = generate(lambda **options: subdomainCandidates(BASES, SUFFIXES, PATTERNS, WORDS, **options))
+        templates = history.rank(PATTERNS, WORDS, SUFFIXES)
+        names, stats = generate(lambda **options: templateCandidates(BASES, templates, **options))
+        self.assertEqual(collections.Counter(names), collections.Counter(expected))
+        self.assertEqual(stats, expectedStats)
+
+    def test_same_names_as_subdomain_candidates(self):
+        self.assertSameAsSubdomainCandidates(HitHistory(':memory:'))
+
+    def test_same_names_when_ranked(self):
+        self.assertSameAsSubdomainCandidates(skewedHistory())
+
+    def test_parts_add_up_to_the_whole(self):
+        templates = skewedHistory().rank(PATTERNS, WORDS, SUFFIXES)
+        whole, wholeStats = generate(lambda **options: templateCandidates(BASES, templates, **options))
+        for parts in (2, 3, 7):
+            names, stats = generate(lambda **options: templateCandidates(BASES, templates, **options), parts)
+            self.assertEqual(sorted(names), sorted(whole))
+            self.assertEqual(stats, wholeStats)
+
+    def test_likeliest_templates_come_first(self):
+        history = skewedHistory()
+        templates = history.rank(PATTERNS, WORDS, SUFFIXES)
+        ranked = list(templates)
+        scores = [-templates.key(*template)[0] for template in ranked]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(len(set(ranked)), len(ranked))
+        # Every pattern, distinct word and suffix once, with the base on its own for each suffix
+        distinctWords = len(dict.fromkeys(word.lower() for word in WORDS))
+        self.assertEqual(len(ranked), len(SUFFIXES) * (1 + len(PATTERNS) * distinctWords))
+
+
+if __name__ == '__main__':
+    unittest.main()
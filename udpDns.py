@@ -0,0 +1,175 @@
+# Multiplexed raw-UDP DNS engine
+# Keeps a few UDP sockets open to each upstream resolver and matches replies back to queries by ID and name,
+# so the number of queries in flight is no longer tied to sockets or threads
+
+import asyncio
+import random
+import itertools
+import time
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+
+import scanStats
+from asyncDns import DnsEngine
+from resolverPool import ResolverPool
+
+QUERY_FLAGS = b'\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00' # RD set, one question
+TIMEOUT = object() # marker result for a query that got no reply in time
+RETRY = object() # marker result for a reply that is worth retransmitting (SERVFAIL, REFUSED)
+
+
+class QuerySocket(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+        self.pending = {} # query ID -> (question, future, timer)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        queryId = int.from_bytes(data[:2], 'big')
+        entry = self.pending.get(queryId)
+        if entry is None:
+            return # late reply for a query that already timed out
+        question, future, timer = entry
+        # Only accept the reply if it answers the question we asked under this ID
+        if data[12:12+len(question)].lower() != question:
+            return
+        del self.pending[queryId]
+        timer.cancel()
+        if not future.done():
+            future.set_result(parseResponse(data))
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        for question, future, timer in self.pending.values():
+            timer.cancel()
+            if not future.done():
+                future.set_result(TIMEOUT)
+        self.pending.clear()
+
+    # Sends one A query and returns a future for its parsed result
+    def query(self, question, timeout):
+        loop = asyncio.get_running_loop()
+        queryId = random.getrandbits(16)
+        while queryId in self.pending:
+            queryId = random.getrandbits(16)
+        future = loop.create_future()
+        timer = loop.call_later(timeout, self.expire, queryId)
+        self.pending[queryId] = (question, future, timer)
+        self.transport.sendto(queryId.to_bytes(2, 'big') + QUERY_FLAGS + question)
+        return future
+
+    def expire(self, queryId):
+        entry = self.pending.pop(queryId, None)
+        if entry and not entry[1].done():
+            entry[1].set_result(TIMEOUT)
+
+
+# Wire format of an A/IN question for name, or None if the name can't be a DNS name
+def encodeQuestion(name):
+    try:
+        labels = name.encode('ascii').split(b'.')
+    except UnicodeEncodeError:
+        return None
+    if not all(0 < len(label) < 64 for label in labels):
+        return None
+    return b''.join(bytes([len(label)]) + label for label in labels) + b'\x00\x00\x01\x00\x01'
+
+# returns IP if the reply has an A record, returns '' for NXDOMAIN/NODATA, RETRY for server failures
+def parseResponse(data):
+    # Most replies are NXDOMAIN, so read the rcode and answer count from the header before parsing anything
+    rcode = data[3] & 0x0f
+    if rcode in (dns.rcode.SERVFAIL, dns.rcode.REFUSED):
+        return RETRY
+    if rcode != dns.rcode.NOERROR or data[6:8] == b'\x00\x00':
+        return ''
+    try:
+        response = dns.message.from_wire(data)
+    except Exception:
+        return ''
+    # Azure names are CNAME chains, so take the first A record anywhere in the answer
+    for rrset in response.answer:
+        if rrset.rdtype == dns.rdatatype.A:
+            for rdata in rrset:
+                return rdata.address
+    return ''
+
+
+class UdpDnsEngine(DnsEngine):
+    def __init__(self, nameserver=None, port=53, sockets=4, concurrency=10000, timeout=2.0, retries=2, cache=None, stats=None, limiter=None, pool=None):
+        if pool is None:
+            pool = ResolverPool([f'[{nameserver}]:{port}'] if nameserver else None)
+        self.pool = pool
+        self.numSockets = max(1, sockets)
+        # Query IDs are 16 bits, so each socket can only have 65536 queries outstanding
+        self.concurrency = max(1, min(concurrency, len(pool.upstreams) * self.numSockets * 60000))
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.cache = cache
+        self.stats = stats
+        self.limiter = limiter
+        self.sockets = {} # upstream -> cycle over its sockets
+        self.protocols = []
+        self.startLock = None
+
+    # However high a limiter goes, the 16 bit query IDs still cap what each socket can have outstanding
+    def currentLimit(self):
+        return min(super().currentLimit(), self.concurrency)
+
+    async def start(self):
+        if self.startLock is None:
+            self.startLock = asyncio.Lock()
+        async with self.startLock:
+            if self.sockets:
+                return
+            loop = asyncio.get_running_loop()
+            for upstream in self.pool.upstreams:
+                protocols = []
+                for i in range(self.numSockets):
+                    _, protocol = await loop.create_datagram_endpoint(QuerySocket, remote_addr=(upstream.host, upstream.port))
+                    protocols.append(protocol)
+                self.protocols += protocols
+                self.sockets[upstream] = itertools.cycle(protocols)
+
+    async def resolve(self, name):
+        if not self.sockets:
+            await self.start()
+        question = encodeQuestion(name.rstrip('.').lower())
+        if question is None:
+            return ''
+        tried = set()
+        for attempt in range(self.retries + 1):
+            # Retransmissions go to a different upstream where there is one, with a fresh query ID
+            upstream = await self.pool.acquireAsync(exclude=tried)
+            started = time.perf_counter()
+            # The upstream goes back even when the lookup is cancelled, e.g. by a daemon client hanging up
+            outcome = scanStats.ERROR
+            try:
+                result = await next(self.sockets[upstream]).query(question, self.timeout)
+                if result is TIMEOUT:
+                    outcome = scanStats.TIMEOUT
+                elif result is RETRY:
+                    outcome = scanStats.SERVFAIL
+                else:
+                    outcome = scanStats.NOERROR if result else scanStats.NXDOMAIN
+            finally:
+                self.pool.release(upstream, outcome)
+            self.recordQuery(outcome, started)
+            if result is not TIMEOUT and result is not RETRY:
+                return result
+            tried.add(upstream)
+        return None
+
+    async def close(self):
+        for protocol in self.protocols:
+            if protocol.transport:
+                protocol.transport.close()
+        self.sockets = {}
+        self.protocols = []